@@ -0,0 +1,316 @@
+# bench_encoders.py
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from statistics import median
+
+import PIL
+from PIL import Image
+
+from rich.console import Console
+from rich.progress import Progress
+from rich.table import Table
+
+from build_manifest import atomic_write_json
+from encoders import BACKENDS, VariantSpec
+from resize_planner import target_size
+
+try:
+    import resource
+except ImportError:  # Windows: no peak RSS
+    resource = None
+
+PROJECT_DIR = Path(__file__).resolve().parent
+
+# --- BENCHMARK GRID ---
+# Every combination is encoded for every sampled source image.
+GRID = {
+    "jpeg": {"quality": [80, 90], "speed": [None]},
+    "webp": {"quality": [60, 70, 80, 90], "speed": [None, 0, 10]},
+    "avif": {"quality": [40, 50, 60, 70], "speed": [4, 6, 8]},
+}
+QUICK_GRID = {
+    "jpeg": {"quality": [90], "speed": [None]},
+    "webp": {"quality": [70, 90], "speed": [None]},
+    "avif": {"quality": [50, 60], "speed": [6, 8]},
+}
+SIZES = [100, 75, 50, 25, 10]
+SOURCE_DIRS = [PROJECT_DIR / "images_original" / "chosen", PROJECT_DIR / "public" / "images"]
+DEFAULT_RESULTS_PATH = PROJECT_DIR / "bench_results.json"
+# --- END BENCHMARK GRID ---
+
+console = Console()
+
+
+class _NullProgress:
+    """Stands in for a rich Progress when calling pipeline entry points directly."""
+    def update(self, task_id, advance=0, **kwargs):
+        pass
+
+
+def _peak_rss_kb():
+    if resource is None:
+        return None
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    peak = max(own, children)
+    # macOS reports bytes, Linux kilobytes
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def _output_bytes(directory):
+    return sum(p.stat().st_size for p in Path(directory).rglob("*") if p.is_file())
+
+
+def _run_encode(case, out_dir):
+    """One format × quality × speed × size encode through an encoder backend."""
+    with Image.open(case["image"]) as img:
+        width, height = target_size(img.size, case["percent"])
+    spec = VariantSpec(case["fmt"], width, height, case["quality"], case["speed"])
+    BACKENDS[case["backend"]].encode(case["image"], Path(out_dir) / f"out.{case['fmt']}", spec)
+
+
+def _run_python_only(case, out_dir):
+    import python_only
+    python_only.CONFIG["output_dir"] = str(out_dir)
+    python_only.create_output_dirs(out_dir, ["webp", "avif"])
+    python_only.process_image(Path(case["image"]), _NullProgress(), None)
+
+
+def _run_convert_images(case, out_dir):
+    sys.path.insert(0, str(PROJECT_DIR / "scripts"))
+    import convert_images
+    src = Path(out_dir) / Path(case["image"]).name
+    shutil.copy(case["image"], src)
+    convert_images.ensure_variants(src.stem, [src], Path(out_dir))
+    # The copied source is not an output
+    src.unlink()
+
+
+def _run_squoosh(case, out_dir):
+    """The exact command squoosh.py runs for one image."""
+    import squoosh
+    squoosh.OUTPUT_DIR = str(out_dir)
+    width, height = squoosh.get_new_dimensions(case["image"], squoosh.RESIZE_PERCENTAGE)
+    subprocess.run(squoosh.build_command(case["image"], width, height), check=True, capture_output=True, text=True)
+
+
+def _run_squoosh_fork(case, out_dir):
+    """The full-size and thumbnail commands squoosh_fork.py runs for one image."""
+    import squoosh_fork
+    squoosh_fork.OUTPUT_DIR = str(out_dir)
+    width, height = squoosh_fork.get_image_dimensions(case["image"])
+    full = squoosh_fork.create_resize_json(width, height, squoosh_fork.RESIZE_PERCENTAGE)
+    subprocess.run(squoosh_fork.build_full_command(full, [case["image"]]), check=True, capture_output=True, text=True)
+    thumb = squoosh_fork.create_resize_json(width, height, squoosh_fork.THUMB_RESIZE_PERCENTAGE)
+    subprocess.run(squoosh_fork.build_thumb_command(thumb, [case["image"]]), check=True, capture_output=True, text=True)
+
+
+PIPELINES = {
+    "encode": _run_encode,
+    "python_only.process_image": _run_python_only,
+    "convert_images.ensure_variants": _run_convert_images,
+    "squoosh.py": _run_squoosh,
+    "squoosh_fork.py": _run_squoosh_fork,
+}
+
+
+def run_case(case):
+    """
+    Runs one benchmark case. Called in a fresh worker process, so peak RSS
+    and CPU time belong to this case alone.
+    """
+    with tempfile.TemporaryDirectory() as out_dir:
+        cpu_start = os.times()
+        start = time.perf_counter()
+        PIPELINES[case["pipeline"]](case, out_dir)
+        wall = time.perf_counter() - start
+        cpu_end = os.times()
+        cpu = sum(cpu_end[:4]) - sum(cpu_start[:4])  # user + system, self + children
+        return dict(case, wall_seconds=wall, cpu_seconds=cpu,
+                    peak_rss_kb=_peak_rss_kb(), bytes=_output_bytes(out_dir))
+
+
+def find_sources(sample):
+    """Originals first, then the deployed JPEGs, `sample` per directory."""
+    sources = []
+    for directory in SOURCE_DIRS:
+        if directory.is_dir():
+            found = sorted(p for p in directory.iterdir() if p.suffix.lower() in (".jpg", ".jpeg", ".png"))
+            sources.extend(found[:sample])
+    return sources
+
+
+def build_cases(sources, grid, sizes, backends, pipelines):
+    cases = []
+    for image in sources:
+        for backend in backends:
+            for fmt, axes in grid.items():
+                if fmt not in BACKENDS[backend].formats:
+                    continue
+                for quality in axes["quality"]:
+                    for speed in axes["speed"]:
+                        for percent in sizes:
+                            cases.append({"pipeline": "encode", "backend": backend, "image": str(image),
+                                          "fmt": fmt, "quality": quality, "speed": speed, "percent": percent})
+        for pipeline in pipelines:
+            cases.append({"pipeline": pipeline, "image": str(image)})
+    return cases
+
+
+def case_key(result):
+    """Identifies the same case across runs, independent of measurements."""
+    fields = ("pipeline", "backend", "image", "fmt", "quality", "speed", "percent")
+    return tuple(str(result.get(f)) for f in fields)
+
+
+def summarize_repeats(runs):
+    """Median of each measurement over repeated runs of one case."""
+    summary = dict(runs[0])
+    for field in ("wall_seconds", "cpu_seconds", "peak_rss_kb", "bytes"):
+        values = [r[field] for r in runs if r[field] is not None]
+        summary[field] = median(values) if values else None
+    return summary
+
+
+def pareto_front(points):
+    """Points not beaten on both bytes and time by any other point."""
+    front = []
+    for p in sorted(points, key=lambda p: (p["bytes"], p["wall_seconds"])):
+        if not front or p["wall_seconds"] < front[-1]["wall_seconds"]:
+            front.append(p)
+    return front
+
+
+def print_pareto(results):
+    """Aggregates encode results over images and prints the bytes vs time front per format and size."""
+    totals = {}
+    for r in results:
+        if r["pipeline"] != "encode":
+            continue
+        key = (r["fmt"], r["percent"], r["backend"], r["quality"], r["speed"])
+        t = totals.setdefault(key, {"bytes": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "peak_rss_kb": 0})
+        t["bytes"] += r["bytes"]
+        t["wall_seconds"] += r["wall_seconds"]
+        t["cpu_seconds"] += r["cpu_seconds"]
+        t["peak_rss_kb"] = max(t["peak_rss_kb"], r["peak_rss_kb"] or 0)
+
+    groups = {}
+    for (fmt, percent, backend, quality, speed), t in totals.items():
+        groups.setdefault((fmt, percent), []).append(dict(t, backend=backend, quality=quality, speed=speed))
+
+    for (fmt, percent), points in sorted(groups.items()):
+        table = Table(title=f"Pareto front: {fmt} at {percent}%")
+        for column in ("Backend", "Quality", "Speed", "KiB", "Wall", "CPU", "Peak RSS"):
+            table.add_column(column, justify="right" if column not in ("Backend",) else "left")
+        for p in pareto_front(points):
+            table.add_row(p["backend"], str(p["quality"]), str(p["speed"]),
+                          f"{p['bytes'] / 1024:.1f}", f"{p['wall_seconds']:.2f}s",
+                          f"{p['cpu_seconds']:.2f}s", f"{p['peak_rss_kb'] / 1024:.0f} MiB")
+        console.print(table)
+
+    pipelines = [r for r in results if r["pipeline"] != "encode"]
+    if pipelines:
+        table = Table(title="Pipeline entry points")
+        for column in ("Pipeline", "Image", "KiB", "Wall", "CPU", "Peak RSS"):
+            table.add_column(column)
+        for r in sorted(pipelines, key=lambda r: (r["pipeline"], r["image"])):
+            rss = f"{r['peak_rss_kb'] / 1024:.0f} MiB" if r["peak_rss_kb"] else "-"
+            table.add_row(r["pipeline"], Path(r["image"]).name, f"{r['bytes'] / 1024:.1f}",
+                          f"{r['wall_seconds']:.2f}s", f"{r['cpu_seconds']:.2f}s", rss)
+        console.print(table)
+
+
+def compare_with_baseline(results, baseline_path, tolerance):
+    """Returns the cases that got slower or bigger than the baseline by more than `tolerance`."""
+    baseline = {case_key(r): r for r in json.loads(Path(baseline_path).read_text())["results"]}
+    regressions = []
+    for r in results:
+        b = baseline.get(case_key(r))
+        if not b:
+            continue
+        for field in ("wall_seconds", "bytes"):
+            if b[field] and r[field] > b[field] * (1 + tolerance):
+                regressions.append((r, field, b[field], r[field]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark encoder settings and image pipelines")
+    parser.add_argument("--sample", type=int, default=3, help="Source images per source directory")
+    parser.add_argument("--quick", action="store_true", help="Use the reduced settings grid")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="Resize percentages to sweep")
+    parser.add_argument("--backends", nargs="+", default=["pillow"], choices=sorted(BACKENDS),
+                        help="Encoder backends to sweep")
+    parser.add_argument("--pipelines", nargs="*", default=[p for p in PIPELINES if p != "encode"],
+                        choices=[p for p in PIPELINES if p != "encode"], help="Pipeline entry points to time")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per case; the median is reported")
+    parser.add_argument("--output", "-o", type=str, default=str(DEFAULT_RESULTS_PATH), help="Results JSON")
+    parser.add_argument("--baseline", type=str, help="Earlier results JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="Allowed slowdown/growth against the baseline (0.15 = 15%%)")
+    args = parser.parse_args(argv)
+
+    sources = find_sources(args.sample)
+    if not sources:
+        console.print("[yellow]No source images found.[/yellow]")
+        sys.exit(1)
+
+    grid = QUICK_GRID if args.quick else GRID
+    cases = build_cases(sources, grid, args.sizes, args.backends, args.pipelines)
+    console.print(f"Running [bold cyan]{len(cases)}[/bold cyan] cases × {args.repeat} on {len(sources)} images...")
+
+    runs = {}
+    errors = []
+    # One case per worker process, one worker at a time: measurements don't
+    # compete for cores and every case starts with a fresh peak RSS
+    with Progress(console=console) as progress:
+        task = progress.add_task("[green]Benchmarking...", total=len(cases) * args.repeat)
+        with ProcessPoolExecutor(max_workers=1, max_tasks_per_child=1) as pool:
+            for case in cases:
+                for _ in range(args.repeat):
+                    try:
+                        result = pool.submit(run_case, case).result()
+                        runs.setdefault(case_key(result), []).append(result)
+                    except Exception as e:
+                        errors.append((case, e))
+                    progress.update(task, advance=1)
+
+    results = [summarize_repeats(r) for r in runs.values()]
+    atomic_write_json(args.output, {
+        "meta": {
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "repeat": args.repeat,
+        },
+        "results": results,
+    })
+    print_pareto(results)
+    console.print(f"Results written to [bold]{args.output}[/bold]")
+
+    for case, e in errors:
+        console.print(f"[bold red]{case['pipeline']} failed on {Path(case['image']).name}: {e}[/bold red]")
+
+    if args.baseline:
+        regressions = compare_with_baseline(results, args.baseline, args.tolerance)
+        for r, field, before, after in regressions:
+            console.print(f"[bold red]Regression[/bold red] {r['pipeline']} {Path(r['image']).name} "
+                          f"{r.get('fmt', '')} q{r.get('quality', '')} s{r.get('speed', '')} "
+                          f"{r.get('percent', '')}%: {field} {before:.3g} → {after:.3g}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+# build_manifest.py
+
+import os
+import json
+import hashlib
+import tempfile
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Default location of the manifest, shared by python_only.py and
+# scripts/convert_images.py. Entries are keyed by output path relative to
+# the manifest, so both scripts can record into the same file.
+DEFAULT_MANIFEST_PATH = Path(__file__).resolve().parent / ".image-build-manifest.json"
+
+MANIFEST_VERSION = 1
+
+# mkstemp creates files as 0600; written JSON gets the mode a plain open() would
+# have given it, so files served from public/ stay world-readable. The umask can
+# only be read by setting it, so that's done once, before any threads start.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """Returns the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def _cached_hash(path, mtime_ns, size):
+    return file_hash(path)
+
+
+def source_hash(path):
+    """Content hash of a source image, computed once per version of the file."""
+    st = os.stat(path)
+    return _cached_hash(str(path), st.st_mtime_ns, st.st_size)
+
+
+def atomic_write_json(path, data):
+    """Writes JSON to a temp file next to `path` and renames it into place."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        os.chmod(tmp_path, 0o666 & ~_UMASK)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+@contextmanager
+def atomic_output(path):
+    """
+    Yields a temp path next to `path` to write an output to, and renames it
+    into place only once writing succeeded. Readers (e.g. the Vite dev
+    server) never see a half-written file.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.stem}.{os.getpid()}.tmp{path.suffix}")
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+class BuildLocked(Exception):
+    """Another process is building into the same manifest."""
+
+    def __init__(self, holder):
+        super().__init__(f"another build is running (pid {holder or 'unknown'})")
+        self.holder = holder
+
+
+class BuildLock:
+    """
+    Exclusive lock next to the manifest (`<manifest>.lock`, holding the owner's
+    pid). BuildManifest.save() rewrites the whole file, so two processes
+    building at once would silently drop each other's entries. Released when
+    the holder exits, however it exits. A no-op where fcntl is unavailable.
+    """
+
+    def __init__(self, manifest_path=DEFAULT_MANIFEST_PATH):
+        path = Path(manifest_path)
+        self.path = path.with_name(path.name + ".lock")
+        self.file = None
+
+    def holder(self):
+        try:
+            return int(self.path.read_text().strip() or 0) or None
+        except (OSError, ValueError):
+            return None
+
+    def acquire(self, wait=False):
+        """Takes the lock, or raises BuildLocked if it is held and `wait` is false."""
+        if fcntl is None or self.file is not None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        f = open(self.path, "a+")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            raise BuildLocked(self.holder())
+        f.seek(0)
+        f.truncate()
+        f.write(str(os.getpid()))
+        f.flush()
+        self.file = f
+
+    def release(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class BuildManifest:
+    """
+    Persistent record of every generated variant: the source it came from,
+    the source's content hash, the encoder settings used and the hash of
+    the output that was written. A variant only needs re-encoding when one
+    of those no longer matches.
+    """
+
+    def __init__(self, path=DEFAULT_MANIFEST_PATH, autosave_every=None):
+        self.path = Path(path).resolve()
+        self.root = self.path.parent
+        self.entries = {}
+        # Save after this many records, so a killed run loses at most that many outputs
+        self.autosave_every = autosave_every
+        self._hash_cache = {}
+        self._dirty = False
+        self._unsaved = 0
+        if self.path.exists():
+            try:
+                data = json.loads(self.path.read_text(encoding="utf-8"))
+                if data.get("version") == MANIFEST_VERSION:
+                    self.entries = data.get("variants", {})
+            except (OSError, ValueError):
+                # A corrupt manifest only costs one full rebuild
+                self.entries = {}
+
+    def _key(self, path):
+        return os.path.relpath(Path(path).resolve(), self.root).replace(os.sep, "/")
+
+    def _stat(self, path):
+        st = os.stat(path)
+        return st.st_size, st.st_mtime_ns
+
+    def hash(self, path):
+        """Content hash of `path`, computed once per run."""
+        key = self._key(path)
+        if key not in self._hash_cache:
+            self._hash_cache[key] = file_hash(path)
+        return self._hash_cache[key]
+
+    def invalidate(self, path):
+        """Forgets the cached content hash of `path`, e.g. after a file event."""
+        self._hash_cache.pop(self._key(path), None)
+
+    def _output_matches(self, path, entry):
+        """True if the file on disk is still the one we wrote."""
+        try:
+            size, mtime_ns = self._stat(path)
+        except OSError:
+            return False
+        if (size, mtime_ns) == (entry.get("output_size"), entry.get("output_mtime_ns")):
+            return True
+        return self.hash(path) == entry.get("output_hash")
+
+    def is_fresh(self, output_path, source_hash, settings):
+        """True if `output_path` was built from this source content with these settings."""
+        entry = self.entries.get(self._key(output_path))
+        if not entry:
+            return False
+        if entry.get("source_hash") != source_hash or entry.get("settings") != settings:
+            return False
+        return self._output_matches(output_path, entry)
+
+    def is_generated(self, path):
+        """True if `path` is a recorded output that has not been edited since."""
+        entry = self.entries.get(self._key(path))
+        return bool(entry) and self._output_matches(path, entry)
+
+    def has_any(self, paths):
+        """True if any of `paths` has a manifest entry."""
+        return any(self._key(p) in self.entries for p in paths)
+
+    def record(self, output_path, source_path, source_hash, settings):
+        """Records a freshly written output."""
+        key = self._key(output_path)
+        self._hash_cache.pop(key, None)
+        size, mtime_ns = self._stat(output_path)
+        self.entries[key] = {
+            "source": self._key(source_path),
+            "source_hash": source_hash,
+            "settings": settings,
+            "output_hash": self.hash(output_path),
+            "output_size": size,
+            "output_mtime_ns": mtime_ns,
+        }
+        self._dirty = True
+        self._unsaved += 1
+        if self.autosave_every and self._unsaved >= self.autosave_every:
+            self.save()
+
+    def update_output(self, output_path):
+        """Re-records an output after a pixel-identical rewrite, keeping its source and settings."""
+        key = self._key(output_path)
+        entry = self.entries.get(key)
+        if not entry:
+            return
+        self._hash_cache.pop(key, None)
+        entry["output_size"], entry["output_mtime_ns"] = self._stat(output_path)
+        entry["output_hash"] = self.hash(output_path)
+        self._dirty = True
+
+    def forget(self, path):
+        """Drops the entry for `path`, e.g. when a former output becomes a source."""
+        if self.entries.pop(self._key(path), None) is not None:
+            self._dirty = True
+
+    def save(self):
+        """Atomically writes the manifest if anything changed."""
+        if not self._dirty:
+            return
+        atomic_write_json(self.path, {"version": MANIFEST_VERSION, "variants": self.entries})
+        self._dirty = False
+        self._unsaved = 0
@@ -0,0 +1,217 @@
+# catalog_graph.py
+
+import re
+import csv
+import json
+import argparse
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parent
+PRODUCTS_CSV = PROJECT_DIR / "public" / "catalog" / "products.csv"
+PRODUCTS_TS = PROJECT_DIR / "src" / "data" / "products.ts"
+IMAGES_DIR = PROJECT_DIR / "public" / "images"
+# srcset manifest written by python_only.py; holds the --dedupe aliases
+RESPONSIVE_MANIFEST = IMAGES_DIR / "manifest.json"
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".avif")
+# Suffixes the pipelines add to a source stem (python_only.py sizes and thumbnails)
+VARIANT_SUFFIXES = ("_thumb", "_75", "_50", "_25")
+# Subdirectories of generated files that belong to no single stem (sprite_atlas.py)
+SHARED_DIRS = ("atlas",)
+
+# Any URL or path pointing into /images/, e.g. https://shop.../images/mug_1.jpg
+_IMAGE_URL = re.compile(r"""/images/([^'"\s?#)]+\.(?:jpe?g|png|webp|avif))""", re.IGNORECASE)
+_BLOCK_COMMENT = re.compile(r"/\*.*?\*/", re.DOTALL)
+_PRODUCT_ID = re.compile(r"""^\s*id:\s*['"]([^'"]+)['"]""")
+
+
+def stem_of(url_path):
+    return Path(url_path).stem
+
+
+def _strip_comments(source):
+    """Drops /* */ blocks and whole-line // comments (commented-out products don't count)."""
+    source = _BLOCK_COMMENT.sub("", source)
+    return "\n".join(line for line in source.splitlines() if not line.lstrip().startswith("//"))
+
+
+def references_from_ts(path=PRODUCTS_TS):
+    """(stem, product id) pairs for every image URL in products.ts, in file order."""
+    refs = []
+    product = None
+    for line in _strip_comments(Path(path).read_text(encoding="utf-8")).splitlines():
+        match = _PRODUCT_ID.match(line)
+        if match:
+            product = match.group(1)
+        for url in _IMAGE_URL.findall(line):
+            refs.append((stem_of(url), product))
+    return refs
+
+
+def thumbnails_from_ts(path=PRODUCTS_TS):
+    """
+    {product id: stem} of the image each ProductCard shows: the product's
+    `thumbnail`, else its first image. In products.ts order.
+    """
+    thumbs = {}
+    explicit = set()
+    product = None
+    for line in _strip_comments(Path(path).read_text(encoding="utf-8")).splitlines():
+        match = _PRODUCT_ID.match(line)
+        if match:
+            product = match.group(1)
+            continue
+        urls = _IMAGE_URL.findall(line)
+        if product is None or not urls or product in explicit:
+            continue
+        if line.lstrip().startswith("thumbnail"):
+            thumbs[product] = stem_of(urls[0])
+            explicit.add(product)
+        elif product not in thumbs:
+            thumbs[product] = stem_of(urls[0])
+    return thumbs
+
+
+def references_from_csv(path=PRODUCTS_CSV):
+    """(stem, row id) pairs for every image_link in products.csv, in row order."""
+    refs = []
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            match = _IMAGE_URL.search(row.get("image_link") or "")
+            if match:
+                refs.append((stem_of(match.group(1)), row.get("id")))
+    return refs
+
+
+def build_graph(ts_path=PRODUCTS_TS, csv_path=PRODUCTS_CSV):
+    """
+    Maps every referenced image stem to the products that use it, ordered by
+    first appearance: products.ts (what the storefront renders) first, then
+    products.csv (the commerce feed).
+    """
+    graph = {}
+    sources = []
+    if Path(ts_path).exists():
+        sources.append(references_from_ts(ts_path))
+    if Path(csv_path).exists():
+        sources.append(references_from_csv(csv_path))
+    for refs in sources:
+        for stem, product in refs:
+            users = graph.setdefault(stem, [])
+            if product and product not in users:
+                users.append(product)
+    return graph
+
+
+def product_pages(ts_path=PRODUCTS_TS, csv_path=PRODUCTS_CSV):
+    """
+    {product page id: stems shown on it}: the product's and its variations'
+    images from products.ts, plus the image_link of every products.csv row
+    grouped by item_group_id (the product page the feed links to).
+    """
+    pages = {}
+    if Path(ts_path).exists():
+        for stem, product in references_from_ts(ts_path):
+            if product:
+                stems = pages.setdefault(product, [])
+                if stem not in stems:
+                    stems.append(stem)
+    if Path(csv_path).exists():
+        with open(csv_path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                match = _IMAGE_URL.search(row.get("image_link") or "")
+                page = row.get("item_group_id") or row.get("id")
+                if match and page:
+                    stems = pages.setdefault(page, [])
+                    if stem_of(match.group(1)) not in stems:
+                        stems.append(stem_of(match.group(1)))
+    return pages
+
+
+def source_stem(file_stem, referenced, suffixes=VARIANT_SUFFIXES):
+    """The referenced stem a generated file belongs to, or None if it is an orphan."""
+    if file_stem in referenced:
+        return file_stem
+    for suffix in suffixes:
+        if file_stem.endswith(suffix) and file_stem[:-len(suffix)] in referenced:
+            return file_stem[:-len(suffix)]
+    return None
+
+
+def load_aliases(path=RESPONSIVE_MANIFEST):
+    """{alias stem: encoded stem} from the srcset manifest, or {} if there is none."""
+    try:
+        return json.loads(Path(path).read_text(encoding="utf-8")).get("aliases", {})
+    except (OSError, ValueError):
+        return {}
+
+
+def is_alias_variant(file_stem, aliases, suffixes=VARIANT_SUFFIXES):
+    """
+    True for a generated size of an aliased stem (e.g. cap_copy_75), which
+    --dedupe no longer writes. The alias's full-size file stays: the catalog
+    links to it directly.
+    """
+    return any(file_stem.endswith(s) and file_stem[:-len(s)] in aliases for s in suffixes)
+
+
+def find_orphans(graph, images_dir=IMAGES_DIR, suffixes=VARIANT_SUFFIXES, aliases=None):
+    """
+    Image files under `images_dir` (recursively) that no catalog entry
+    references, plus the generated sizes of aliased duplicates.
+    """
+    orphans = []
+    for path in sorted(Path(images_dir).rglob("*")):
+        if any(part in SHARED_DIRS for part in path.relative_to(images_dir).parts[:-1]):
+            continue
+        if path.is_file() and path.suffix.lower() in IMAGE_EXTENSIONS:
+            if source_stem(path.stem, graph, suffixes) is None or is_alias_variant(path.stem, aliases or {}, suffixes):
+                orphans.append(path)
+    return orphans
+
+
+def find_missing(graph, images_dir=IMAGES_DIR):
+    """Referenced stems with no file at all in `images_dir`."""
+    present = {p.stem for p in Path(images_dir).rglob("*") if p.suffix.lower() in IMAGE_EXTENSIONS}
+    return [stem for stem in graph if stem not in present]
+
+
+def order_by_catalog(paths, graph):
+    """Keeps only catalog-referenced source files, in catalog order."""
+    rank = {stem: i for i, stem in enumerate(graph)}
+    return sorted((p for p in paths if Path(p).stem in rank), key=lambda p: rank[Path(p).stem])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report or prune images the catalog does not reference")
+    parser.add_argument("--images", type=str, default=str(IMAGES_DIR), help="Images directory to check")
+    parser.add_argument("--prune", action="store_true", help="Delete orphaned image files")
+    parser.add_argument("--dry-run", action="store_true", help="With --prune, only list what would be deleted")
+    args = parser.parse_args(argv)
+
+    graph = build_graph()
+    print(f"Catalog references {len(graph)} image stems:")
+    for stem, products in graph.items():
+        print(f"  {stem}: {', '.join(products) or '-'}")
+
+    missing = find_missing(graph, args.images)
+    if missing:
+        print(f"\nReferenced but missing ({len(missing)}):")
+        for stem in missing:
+            print(f"  {stem}")
+
+    orphans = find_orphans(graph, args.images, aliases=load_aliases(Path(args.images) / "manifest.json"))
+    total = sum(p.stat().st_size for p in orphans)
+    print(f"\nOrphaned files ({len(orphans)}, {total / 1024:.0f} KiB):")
+    for path in orphans:
+        print(f"  {path.relative_to(args.images)}")
+        if args.prune and not args.dry_run:
+            path.unlink()
+
+    if args.prune:
+        verb = "Would delete" if args.dry_run else "Deleted"
+        print(f"\n{verb} {len(orphans)} files ({total / 1024:.0f} KiB).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+# decoded_cache.py
+
+import os
+import mmap
+import struct
+import argparse
+from pathlib import Path
+from PIL import Image
+
+from build_manifest import atomic_output, source_hash
+
+PROJECT_DIR = Path(__file__).resolve().parent
+DEFAULT_DECODED_CACHE_DIR = PROJECT_DIR / ".decoded-cache"
+
+# magic, version, mode (NUL padded), width, height; padded to HEADER_SIZE so
+# the pixels start on an aligned offset.
+_HEADER = struct.Struct("<4sB7sII")
+HEADER_SIZE = 64
+MAGIC = b"RAWI"
+VERSION = 1
+
+# Pillow can only wrap a buffer without copying for these modes, so RGB is
+# stored padded to RGBX (the layout Pillow uses in memory anyway).
+STORED_MODES = ("L", "RGBX", "RGBA")
+
+
+def storable(img):
+    """Converts a decoded image to the closest mode that can be mapped zero-copy."""
+    if img.mode in STORED_MODES:
+        return img
+    if img.mode in ("LA", "PA", "RGBa", "La") or (img.mode == "P" and "transparency" in img.info):
+        return img.convert("RGBA")
+    if img.mode == "1":
+        return img.convert("L")
+    return img.convert("RGB").convert("RGBX")
+
+
+def standard_mode(img):
+    """RGBX (as returned for RGB sources) -> RGB, for encoders that don't take RGBX."""
+    return img.convert("RGB") if img.mode == "RGBX" else img
+
+
+class DecodedCache:
+    """
+    Decoded pixels of source images, one raw file per source content hash.
+    The first reader decodes and writes the buffer; every later reader, in
+    any process or run, maps it and gets an Image backed directly by the
+    page cache instead of decoding again. A changed source has a new hash
+    and so simply misses. Disabled caches decode normally.
+    """
+
+    def __init__(self, directory=DEFAULT_DECODED_CACHE_DIR):
+        self.directory = Path(directory)
+        self.enabled = False
+
+    def enable(self, directory=None):
+        if directory:
+            self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.enabled = True
+
+    def _path(self, key):
+        return self.directory / f"{key}.raw"
+
+    def _map(self, cache_path):
+        with open(cache_path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, mode, width, height = _HEADER.unpack_from(buffer)
+        mode = mode.rstrip(b"\0").decode()
+        if magic != MAGIC or version != VERSION or mode not in STORED_MODES:
+            raise ValueError(f"{cache_path} is not a decoded-cache file")
+        pixels = memoryview(buffer)[HEADER_SIZE:]
+        if len(pixels) != width * height * len(mode):
+            raise ValueError(f"{cache_path} is truncated")
+        # The image keeps the mapping alive; it is unmapped once the image is gone
+        return Image.frombuffer(mode, (width, height), pixels, "raw", mode, 0, 1)
+
+    def _store(self, cache_path, img):
+        header = _HEADER.pack(MAGIC, VERSION, img.mode.encode(), *img.size).ljust(HEADER_SIZE, b"\0")
+        # Concurrent writers of the same source each rename a complete file into place
+        with atomic_output(cache_path) as tmp_path:
+            with open(tmp_path, "wb") as f:
+                f.write(header)
+                f.write(img.tobytes())
+
+    def open(self, path):
+        """
+        The fully decoded source as a read-only Image (mode L, RGBX or RGBA),
+        mapped from the cache when possible. The caller closes it.
+        """
+        if not self.enabled:
+            img = Image.open(path)
+            img.load()
+            return img
+        cache_path = self._path(source_hash(path))
+        if cache_path.exists():
+            try:
+                img = self._map(cache_path)
+                os.utime(cache_path)
+                return img
+            except (OSError, ValueError, struct.error):
+                cache_path.unlink(missing_ok=True)
+        with Image.open(path) as src:
+            img = storable(src)
+            img.load()
+        self._store(cache_path, img)
+        img.close()
+        return self._map(cache_path)
+
+    def prune(self, max_bytes):
+        """Deletes the least recently used buffers until the cache fits in `max_bytes`."""
+        files = sorted(self.directory.glob("*.raw"), key=lambda p: p.stat().st_mtime)
+        total = sum(p.stat().st_size for p in files)
+        removed = 0
+        for path in files:
+            if total <= max_bytes:
+                break
+            total -= path.stat().st_size
+            path.unlink()
+            removed += 1
+        return removed, total
+
+
+# One cache per process; enabled by the pipelines' --decoded-cache options.
+DECODED = DecodedCache()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or trim the decoded-source cache")
+    parser.add_argument("--dir", type=str, default=str(DEFAULT_DECODED_CACHE_DIR))
+    parser.add_argument("--max-size", type=int, default=None, help="Trim the cache to this many MiB")
+    parser.add_argument("--clear", action="store_true", help="Delete every cached buffer")
+    args = parser.parse_args(argv)
+
+    cache = DecodedCache(args.dir)
+    if not cache.directory.is_dir():
+        print(f"No decoded cache at {cache.directory}")
+        return
+    if args.clear:
+        args.max_size = 0
+    if args.max_size is not None:
+        removed, total = cache.prune(args.max_size * 2**20)
+        print(f"Removed {removed} buffers; {total / 2**20:.0f} MiB left in {cache.directory}")
+    else:
+        files = list(cache.directory.glob("*.raw"))
+        total = sum(p.stat().st_size for p in files)
+        print(f"{len(files)} buffers, {total / 2**20:.0f} MiB in {cache.directory}")
+
+
+if __name__ == "__main__":
+    main()
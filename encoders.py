@@ -0,0 +1,273 @@
+# encoders.py
+
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from PIL import Image
+
+from build_manifest import atomic_write_json
+from resize_planner import DEFAULT_TOLERANCE
+
+# Routing written by `python encoders.py --calibrate`; maps format -> backend name.
+PROJECT_DIR = Path(__file__).resolve().parent
+DEFAULT_ROUTING_PATH = PROJECT_DIR / ".encoder-routing.json"
+
+# A backend "meets the size target" if its output is at most this much larger
+# than the smallest output any backend produced for the same sample.
+DEFAULT_SIZE_SLACK = 1.05
+
+
+@dataclass(frozen=True)
+class VariantSpec:
+    """
+    One output variant, described the same way for every backend.
+
+    quality is Pillow's 0-100 scale (higher is better) and speed is the AVIF
+    0-10 scale (higher is faster, None for the encoder's default); each
+    backend maps them onto its own knobs.
+    """
+    fmt: str
+    width: int
+    height: int
+    quality: int
+    speed: int = None
+
+    def settings(self):
+        return asdict(self)
+
+
+def avif_cq_level(quality):
+    """Maps 0-100 quality onto libaom's 0-63 cqLevel (lower is better)."""
+    return round((100 - quality) * 63 / 100)
+
+
+def webp_method(speed):
+    """Maps 0-10 speed onto libwebp's 0-6 method (higher is slower); 4 is libwebp's default."""
+    if speed is None:
+        return 4
+    return round((10 - speed) * 6 / 10)
+
+
+class EncoderBackend:
+    """Base class: encodes a source file into one variant."""
+    name = "base"
+    formats = ()
+
+    def available(self):
+        return True
+
+    def encode(self, src_path, out_path, spec):
+        raise NotImplementedError
+
+
+class PillowBackend(EncoderBackend):
+    name = "pillow"
+    formats = ("jpeg", "webp", "avif")
+
+    def __init__(self, avif_threads=None):
+        self.avif_threads = avif_threads
+
+    def save(self, img, out_path, spec):
+        """Encodes an already decoded and resized image."""
+        if spec.fmt == "avif":
+            options = {"quality": spec.quality}
+            if spec.speed is not None:
+                options["speed"] = spec.speed
+            if self.avif_threads:
+                options["max_threads"] = self.avif_threads
+            img.save(out_path, "avif", **options)
+        elif spec.fmt == "webp":
+            img.save(out_path, "webp", quality=spec.quality, method=webp_method(spec.speed))
+        else:
+            if img.mode in ("RGBA", "LA", "P"):
+                img = img.convert("RGB")
+            img.save(out_path, "JPEG", quality=spec.quality)
+
+    def encode(self, src_path, out_path, spec):
+        with Image.open(src_path) as img:
+            resized = img.resize((spec.width, spec.height), Image.Resampling.LANCZOS, reducing_gap=DEFAULT_TOLERANCE)
+            self.save(resized, out_path, spec)
+
+
+class SquooshBackend(EncoderBackend):
+    """@squoosh/cli, as used by squoosh.py."""
+    name = "squoosh"
+    package = "@squoosh/cli"
+    formats = ("webp", "avif")
+
+    def available(self):
+        return shutil.which("npx") is not None
+
+    def codec_options(self, spec):
+        if spec.fmt == "avif":
+            options = {"cqLevel": avif_cq_level(spec.quality)}
+            if spec.speed is not None:
+                options["speed"] = spec.speed
+            return "--avif", json.dumps(options)
+        return "--webp", json.dumps({"quality": spec.quality, "method": webp_method(spec.speed)})
+
+    def encode(self, src_path, out_path, spec):
+        resize = {
+            "enabled": True, "width": spec.width, "height": spec.height,
+            "method": "lanczos3", "fitMethod": "stretch", "premultiply": True, "linearRGB": True
+        }
+        with tempfile.TemporaryDirectory() as tmp:
+            command = ["npx", self.package, "--resize", json.dumps(resize),
+                       *self.codec_options(spec), "-d", tmp, str(src_path)]
+            subprocess.run(command, check=True, capture_output=True, text=True)
+            # The CLI names outputs after the input stem
+            produced = Path(tmp) / f"{Path(src_path).stem}.{spec.fmt}"
+            shutil.move(str(produced), out_path)
+
+
+class SquooshForkBackend(SquooshBackend):
+    """@frostoven/squoosh-cli, as used by squoosh_fork.py."""
+    name = "squoosh-fork"
+    package = "@frostoven/squoosh-cli"
+
+
+# Small sharp driver; receives [src, out, spec] as JSON on argv.
+SHARP_SCRIPT = """
+const sharp = require('sharp');
+const [src, out, spec] = JSON.parse(process.argv[1]);
+let pipeline = sharp(src).resize(spec.width, spec.height, { fit: 'fill', kernel: 'lanczos3' });
+if (spec.fmt === 'avif') pipeline = pipeline.avif({ quality: spec.quality, effort: spec.effort });
+else if (spec.fmt === 'webp') pipeline = pipeline.webp({ quality: spec.quality, effort: spec.effort });
+else pipeline = pipeline.jpeg({ quality: spec.quality, mozjpeg: true });
+pipeline.toFile(out).catch((err) => { console.error(err.message); process.exit(1); });
+"""
+
+
+class SharpBackend(EncoderBackend):
+    """The `sharp` package from package.json, driven through node."""
+    name = "sharp"
+    formats = ("jpeg", "webp", "avif")
+
+    def available(self):
+        return shutil.which("node") is not None and (PROJECT_DIR / "node_modules" / "sharp").is_dir()
+
+    def encode(self, src_path, out_path, spec):
+        # sharp's effort runs the other way: 0 is fastest (avif 0-9, webp 0-6)
+        top = 9 if spec.fmt == "avif" else 6
+        payload = spec.settings()
+        if spec.speed is not None:
+            payload["effort"] = round((10 - spec.speed) * top / 10)
+        subprocess.run(
+            ["node", "-e", SHARP_SCRIPT, json.dumps([str(src_path), str(out_path), payload])],
+            check=True, capture_output=True, text=True, cwd=PROJECT_DIR
+        )
+
+
+BACKENDS = {b.name: b for b in (PillowBackend(), SquooshBackend(), SquooshForkBackend(), SharpBackend())}
+
+
+def load_routing(path=DEFAULT_ROUTING_PATH):
+    """Returns the calibrated format -> backend name map, or {} if none was saved."""
+    try:
+        return json.loads(Path(path).read_text(encoding="utf-8")).get("routes", {})
+    except (OSError, ValueError):
+        return {}
+
+
+def backend_for(fmt, routing=None):
+    """Returns the backend routed for `fmt`, falling back to Pillow."""
+    name = (routing or {}).get(fmt, "pillow")
+    backend = BACKENDS.get(name)
+    if backend is None or fmt not in backend.formats or not backend.available():
+        return BACKENDS["pillow"]
+    return backend
+
+
+def calibrate(sample_paths, specs_for, formats=("jpeg", "webp", "avif"), size_slack=DEFAULT_SIZE_SLACK):
+    """
+    Encodes every sample with every available backend and measures wall time
+    and output bytes. `specs_for(src_path, fmt)` returns the VariantSpec to use.
+
+    Returns (routes, measurements): routes maps each format to the fastest
+    backend whose total output is within `size_slack` of the smallest one.
+    """
+    measurements = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for fmt in formats:
+            for backend in BACKENDS.values():
+                if fmt not in backend.formats or not backend.available():
+                    continue
+                seconds, total_bytes = 0.0, 0
+                try:
+                    for i, src in enumerate(sample_paths):
+                        out = Path(tmp) / f"{backend.name}_{i}.{fmt}"
+                        start = time.perf_counter()
+                        backend.encode(src, out, specs_for(src, fmt))
+                        seconds += time.perf_counter() - start
+                        total_bytes += out.stat().st_size
+                except (OSError, subprocess.CalledProcessError) as e:
+                    print(f"  {backend.name} failed on {fmt}: {e}")
+                    continue
+                measurements.setdefault(fmt, {})[backend.name] = {
+                    "seconds": seconds,
+                    "bytes": total_bytes,
+                    "images_per_second": len(sample_paths) / seconds if seconds else 0.0,
+                }
+
+    routes = {}
+    for fmt, results in measurements.items():
+        smallest = min(r["bytes"] for r in results.values())
+        eligible = {n: r for n, r in results.items() if r["bytes"] <= smallest * size_slack}
+        routes[fmt] = min(eligible, key=lambda n: eligible[n]["seconds"])
+    return routes, measurements
+
+
+def main(argv=None):
+    # python_only.py owns the production settings; imported lazily so this
+    # module stays importable from worker processes without a cycle
+    import python_only
+    from resize_planner import target_size
+
+    parser = argparse.ArgumentParser(description="Measure encoder backends and route each format to the fastest one")
+    parser.add_argument("--calibrate", action="store_true", help="Run calibration and save the routing")
+    parser.add_argument("--sample", type=int, default=5, help="Number of source images to calibrate on")
+    parser.add_argument("--percent", type=int, default=50, help="Resize percentage used for calibration")
+    parser.add_argument("--size-slack", type=float, default=DEFAULT_SIZE_SLACK,
+                        help="Allowed output size relative to the smallest backend (1.05 = 5%% larger)")
+    parser.add_argument("--routing", type=str, default=str(DEFAULT_ROUTING_PATH), help="Routing file")
+    args = parser.parse_args(argv)
+
+    if not args.calibrate:
+        for fmt in ("jpeg", "webp", "avif"):
+            print(f"{fmt}: {backend_for(fmt, load_routing(args.routing)).name}")
+        return
+
+    input_dir = Path(python_only.CONFIG["input_dir"])
+    if not input_dir.is_dir():
+        print(f"Error: Input directory '{input_dir}' not found.")
+        sys.exit(1)
+    samples = sorted(p for p in input_dir.iterdir() if p.suffix.lower() in (".jpg", ".jpeg", ".png"))[:args.sample]
+    if not samples:
+        print(f"No images found in '{input_dir}'.")
+        sys.exit(1)
+
+    def specs_for(src, fmt):
+        with Image.open(src) as img:
+            width, height = target_size(img.size, args.percent)
+        return python_only.variant_spec(fmt, width, height)
+
+    print(f"Calibrating on {len(samples)} image(s) at {args.percent}%...")
+    routes, measurements = calibrate(samples, specs_for, size_slack=args.size_slack)
+    for fmt, results in measurements.items():
+        for name, r in sorted(results.items(), key=lambda item: item[1]["seconds"]):
+            marker = "*" if routes[fmt] == name else " "
+            print(f" {marker} {fmt:5} {name:13} {r['seconds']:7.2f}s {r['bytes'] / 1024:9.1f} KiB")
+
+    atomic_write_json(args.routing, {"routes": routes, "measurements": measurements,
+                                     "size_slack": args.size_slack, "sample": [s.name for s in samples]})
+    print(f"Saved routing to {args.routing}")
+
+
+if __name__ == "__main__":
+    main()
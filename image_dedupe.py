@@ -0,0 +1,144 @@
+# image_dedupe.py
+
+import argparse
+from pathlib import Path
+from PIL import Image
+
+try:
+    import numpy as np
+except ImportError:  # dHash alone still works
+    np = None
+
+# Max differing bits (of 64) for two images to count as the same picture.
+# Tight on purpose: different shots of one product must stay separate, only
+# re-uploads, re-encodes and resized copies should merge.
+DHASH_THRESHOLD = 4
+PHASH_THRESHOLD = 6
+# Crops are different images even when their hashes are close
+ASPECT_TOLERANCE = 0.02
+
+SOURCE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".avif")
+
+
+def _gray(path, size):
+    """The image as a small grayscale copy, decoded at the smallest JPEG scale that covers it."""
+    with Image.open(path) as img:
+        original_size = img.size
+        if img.format == "JPEG":
+            img.draft("L", (size[0] * 2, size[1] * 2))
+        gray = img.convert("L").resize(size, Image.Resampling.LANCZOS)
+    return gray, original_size
+
+
+def dhash(gray):
+    """64-bit difference hash of a 9×8 grayscale image: is each pixel brighter than its right neighbour?"""
+    pixels = gray.tobytes()
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return bits
+
+
+def _dct_matrix(n):
+    k = np.arange(n)
+    matrix = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n))
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+def phash(gray):
+    """64-bit perceptual hash of a 32×32 grayscale image: low DCT frequencies above their median."""
+    pixels = np.asarray(gray, dtype=np.float64)
+    dct = _dct_matrix(32)
+    low = (dct @ pixels @ dct.T)[:8, :8].flatten()
+    median = np.median(low[1:])  # the DC term only says how bright the image is
+    bits = 0
+    for value in low:
+        bits = (bits << 1) | int(value > median)
+    return bits
+
+
+def distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+def fingerprint(path):
+    """(dhash, phash or None, (width, height)) for one source."""
+    small, size = _gray(path, (9, 8))
+    p = None
+    if np is not None:
+        p = phash(_gray(path, (32, 32))[0])
+    return dhash(small), p, size
+
+
+def is_duplicate(a, b, dhash_threshold=DHASH_THRESHOLD, phash_threshold=PHASH_THRESHOLD):
+    (dh_a, ph_a, (w_a, h_a)), (dh_b, ph_b, (w_b, h_b)) = a, b
+    if abs(w_a / h_a - w_b / h_b) > ASPECT_TOLERANCE * (w_a / h_a):
+        return False
+    if distance(dh_a, dh_b) > dhash_threshold:
+        return False
+    return ph_a is None or ph_b is None or distance(ph_a, ph_b) <= phash_threshold
+
+
+def find_clusters(paths, dhash_threshold=DHASH_THRESHOLD, phash_threshold=PHASH_THRESHOLD):
+    """
+    Groups near-identical images. Returns a list of clusters (lists of Paths),
+    each headed by the copy to encode: the largest, then the biggest file.
+    Unreadable images are left out; images without a duplicate form clusters of one.
+    """
+    prints = {}
+    for path in paths:
+        try:
+            prints[Path(path)] = fingerprint(path)
+        except OSError:
+            continue
+
+    parent = {p: p for p in prints}
+
+    def root(p):
+        while parent[p] != p:
+            parent[p] = parent[parent[p]]
+            p = parent[p]
+        return p
+
+    items = list(prints)
+    for i, a in enumerate(items):
+        for b in items[i + 1:]:
+            if is_duplicate(prints[a], prints[b], dhash_threshold, phash_threshold):
+                parent[root(a)] = root(b)
+
+    groups = {}
+    for p in items:
+        groups.setdefault(root(p), []).append(p)
+
+    def rank(p):
+        width, height = prints[p][2]
+        return (-width * height, -p.stat().st_size, p.name)
+
+    return [sorted(group, key=rank) for group in groups.values()]
+
+
+def aliases_from_clusters(clusters):
+    """{alias stem: representative stem} for every duplicate."""
+    return {p.stem: cluster[0].stem for cluster in clusters for p in cluster[1:]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find near-duplicate source images by perceptual hash")
+    parser.add_argument("directory", nargs="?", default="./images_original/chosen")
+    parser.add_argument("--threshold", type=int, default=DHASH_THRESHOLD, help="Max differing dHash bits (of 64)")
+    args = parser.parse_args(argv)
+
+    paths = sorted(p for p in Path(args.directory).iterdir() if p.suffix.lower() in SOURCE_EXTENSIONS)
+    if np is None:
+        print("numpy not installed: clustering on dHash only")
+    duplicates = [c for c in find_clusters(paths, args.threshold) if len(c) > 1]
+    for cluster in duplicates:
+        print(f"{cluster[0].name}: {', '.join(p.name for p in cluster[1:])}")
+    saved = sum(len(c) - 1 for c in duplicates)
+    print(f"{len(duplicates)} cluster(s); {saved} of {len(paths)} images need no encode of their own")
+
+
+if __name__ == "__main__":
+    main()
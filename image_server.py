@@ -0,0 +1,293 @@
+# image_server.py
+
+import io
+import os
+import hashlib
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+from PIL import Image
+
+from build_manifest import atomic_output
+from encoders import PillowBackend
+from python_only import CONFIG, source_hash, variant_spec
+from resize_planner import open_scaled
+
+PROJECT_DIR = Path(__file__).resolve().parent
+
+# --- Configuration ---
+# Where originals are looked up by stem, first match wins.
+SOURCE_DIRS = [PROJECT_DIR / CONFIG["input_dir"], PROJECT_DIR / CONFIG["output_dir"]]
+SOURCE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".avif")
+
+CACHE_DIR = PROJECT_DIR / ".image-cache"
+CACHE_MAX_MB = 512
+
+# Requested widths are rounded up to a multiple of this, so arbitrary ?w=
+# values can't fill the cache with near-identical copies.
+WIDTH_STEP = 16
+
+# Responses are revalidated with the ETag after a day; a changed source gets a new ETag.
+CACHE_CONTROL = "public, max-age=86400, stale-while-revalidate=604800"
+
+CONTENT_TYPES = {"avif": "image/avif", "webp": "image/webp", "jpeg": "image/jpeg"}
+# --- End of Configuration ---
+
+
+def negotiate_format(accept):
+    """Best format the client says it accepts: AVIF, then WebP, then JPEG."""
+    accept = (accept or "").lower()
+    for fmt in ("avif", "webp"):
+        if CONTENT_TYPES[fmt] in accept:
+            return fmt
+    return "jpeg"
+
+
+def snap_width(width, original_width):
+    """Rounds a requested width up to WIDTH_STEP, never beyond the original."""
+    if width is None or width >= original_width:
+        return original_width
+    return min(original_width, max(WIDTH_STEP, -(-width // WIDTH_STEP) * WIDTH_STEP))
+
+
+def find_source(stem, source_dirs=SOURCE_DIRS):
+    """The original image for `stem`, or None."""
+    if not stem or "/" in stem or "\\" in stem or stem.startswith("."):
+        return None
+    for directory in source_dirs:
+        for ext in SOURCE_EXTENSIONS:
+            path = Path(directory) / f"{stem}{ext}"
+            if path.is_file():
+                return path
+    return None
+
+
+def render(path, width, fmt):
+    """Decodes, resizes and encodes one variant; returns the encoded bytes."""
+    with Image.open(path) as img:
+        original_width, original_height = img.size
+    height = max(1, round(original_height * width / original_width))
+    spec = variant_spec(fmt, width, height)
+    img, _ = open_scaled(path, width / original_width * 100, CONFIG["resize_tolerance"])
+    with img:
+        resized = img if img.size == (width, height) else img.resize(
+            (width, height), Image.Resampling.LANCZOS, reducing_gap=CONFIG["resize_tolerance"])
+        buffer = io.BytesIO()
+        PillowBackend().save(resized, buffer, spec)
+    return buffer.getvalue()
+
+
+class DiskLRU:
+    """
+    Size-bounded cache of encoded variants on disk. Least recently served
+    files are deleted first once the total exceeds `max_bytes`; recency
+    survives restarts through the files' mtimes.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.total = 0
+        for path in sorted(self.directory.glob("*.bin"), key=lambda p: p.stat().st_mtime):
+            size = path.stat().st_size
+            self.entries[path.stem] = size
+            self.total += size
+
+    def _path(self, key):
+        return self.directory / f"{key}.bin"
+
+    def get(self, key):
+        """Cached bytes for `key` (marking it recently used), or None."""
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+        try:
+            data = self._path(key).read_bytes()
+            os.utime(self._path(key))
+            return data
+        except OSError:
+            # Deleted behind our back; treat as a miss
+            with self.lock:
+                self.total -= self.entries.pop(key, 0)
+            return None
+
+    def put(self, key, data):
+        with atomic_output(self._path(key)) as tmp_path:
+            tmp_path.write_bytes(data)
+        with self.lock:
+            self.total += len(data) - self.entries.pop(key, 0)
+            self.entries[key] = len(data)
+            while self.total > self.max_bytes and len(self.entries) > 1:
+                old_key, size = self.entries.popitem(last=False)
+                self.total -= size
+                self._path(old_key).unlink(missing_ok=True)
+
+
+class Coalescer:
+    """Runs one computation per key at a time; concurrent callers share its result."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = {}
+
+    def run(self, key, fn):
+        with self.lock:
+            future = self.in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self.in_flight[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+        return future.result()
+
+
+class ImageService:
+    """Resolves a request to cached or freshly encoded bytes."""
+
+    def __init__(self, cache, source_dirs=SOURCE_DIRS):
+        self.cache = cache
+        self.source_dirs = source_dirs
+        self.coalescer = Coalescer()
+
+    def cache_key(self, path, width, fmt):
+        """Content-addressed: a new source version or new settings never hit an old entry."""
+        quality = variant_spec(fmt, 1, 1).quality
+        raw = f"{source_hash(path)}:{width}:{fmt}:{quality}:{CONFIG['avif_speed']}:{CONFIG['resize_tolerance']}"
+        return hashlib.sha256(raw.encode()).hexdigest()[:32]
+
+    def resolve(self, stem, width, fmt):
+        """
+        Returns (key, source path, snapped width), or None if there's no such
+        image. The key doubles as the ETag and is known before anything is encoded.
+        """
+        path = find_source(stem, self.source_dirs)
+        if path is None:
+            return None
+        with Image.open(path) as img:
+            width = snap_width(width, img.size[0])
+        return self.cache_key(path, width, fmt), path, width
+
+    def fetch(self, key, path, width, fmt):
+        """The encoded bytes for a resolved request, from the cache or encoded once."""
+        data = self.cache.get(key)
+        if data is None:
+            data = self.coalescer.run(key, lambda: self._render_and_store(key, path, width, fmt))
+        return data
+
+    def _render_and_store(self, key, path, width, fmt):
+        # A request that waited on the lock may find it already done
+        data = self.cache.get(key)
+        if data is None:
+            data = render(path, width, fmt)
+            self.cache.put(key, data)
+        return data
+
+
+class ImageRequestHandler(BaseHTTPRequestHandler):
+    """GET /images/<stem>?w=480&fmt=avif; fmt defaults to the best the Accept header allows."""
+    service = None
+
+    def do_GET(self):
+        self.respond(send_body=True)
+
+    def do_HEAD(self):
+        self.respond(send_body=False)
+
+    def respond(self, send_body):
+        url = urlsplit(self.path)
+        if not url.path.startswith("/images/"):
+            self.send_error(404)
+            return
+        stem = url.path[len("/images/"):]
+        query = parse_qs(url.query)
+        fmt = query.get("fmt", [None])[0]
+        if fmt == "jpg":
+            fmt = "jpeg"
+        if fmt is not None and fmt not in CONTENT_TYPES:
+            self.send_error(400, f"Unsupported format: {fmt}")
+            return
+        try:
+            width = int(query["w"][0]) if "w" in query else None
+        except ValueError:
+            self.send_error(400, "w must be an integer")
+            return
+        if width is not None and width <= 0:
+            self.send_error(400, "w must be positive")
+            return
+
+        negotiated = fmt is None
+        fmt = fmt or negotiate_format(self.headers.get("Accept"))
+        try:
+            resolved = self.service.resolve(stem, width, fmt)
+        except Exception as e:
+            self.send_error(500, f"Could not read {stem}: {e}")
+            return
+        if resolved is None:
+            self.send_error(404, f"No image named {stem}")
+            return
+
+        key, path, width = resolved
+        etag = f'"{key}"'
+        # The key is content-addressed, so a matching client copy is current without encoding anything
+        if etag in [t.strip() for t in self.headers.get("If-None-Match", "").split(",")]:
+            self.send_response(304)
+            self.send_cache_headers(etag, negotiated)
+            self.end_headers()
+            return
+
+        try:
+            data = self.service.fetch(key, path, width, fmt)
+        except Exception as e:
+            self.send_error(500, f"Could not encode {stem}: {e}")
+            return
+        self.send_response(200)
+        self.send_cache_headers(etag, negotiated)
+        self.send_header("Content-Type", CONTENT_TYPES[fmt])
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(data)
+
+    def send_cache_headers(self, etag, negotiated):
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", CACHE_CONTROL)
+        if negotiated:
+            self.send_header("Vary", "Accept")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve resized WebP/AVIF/JPEG variants on demand")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--cache-dir", type=str, default=str(CACHE_DIR))
+    parser.add_argument("--cache-size", type=int, default=CACHE_MAX_MB, help="Disk cache limit in MiB")
+    args = parser.parse_args(argv)
+
+    ImageRequestHandler.service = ImageService(DiskLRU(args.cache_dir, args.cache_size * 2**20))
+    server = ThreadingHTTPServer((args.host, args.port), ImageRequestHandler)
+    print(f"Serving /images/<stem>?w=<width>&fmt=<avif|webp|jpeg> on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+# memory_scheduler.py
+
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, wait
+from PIL import Image
+
+from decoded_cache import DECODED
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Pillow stores 3-band images with a padding byte, so RGB costs 4 bytes a pixel.
+_BYTES_PER_PIXEL = {"1": 1, "L": 1, "P": 1, "LA": 4, "La": 4, "PA": 4, "I;16": 2, "I": 4, "F": 4}
+_DEFAULT_BYTES_PER_PIXEL = 4
+
+# Extra working memory an encoder needs, as a multiple of the pixels it encodes
+# (YUV planes, reference frames, output buffers). Deliberately generous.
+ENCODER_OVERHEAD = {"avif": 4.0, "webp": 2.0, "jpeg": 1.5}
+
+# Share of currently available RAM used when no budget is configured.
+AUTO_BUDGET_FRACTION = 0.75
+
+
+def bytes_per_pixel(mode):
+    return _BYTES_PER_PIXEL.get(mode, _DEFAULT_BYTES_PER_PIXEL)
+
+
+def jpeg_draft_scale(size, needed):
+    """The DCT scale (1, 2, 4 or 8) libjpeg picks for Image.draft(mode, needed)."""
+    scale = 1
+    for s in (8, 4, 2):
+        if size[0] // s >= needed[0] and size[1] // s >= needed[1]:
+            scale = s
+            break
+    return scale
+
+
+def estimate_job_bytes(file_path, percent, fmt, tolerance=2.0):
+    """
+    Estimates a job's peak image memory from the file header alone: the
+    decoded source (at the JPEG draft scale the resize planner will use),
+    the resized copy and the encoder's working buffers. With the decoded
+    cache enabled the source is mapped at full size (L stays 1 byte a pixel,
+    everything else is stored as RGBX or RGBA), so there is no draft scale.
+    """
+    with Image.open(file_path) as img:
+        width, height = img.size
+        mode, image_format = img.mode, img.format
+    bpp = bytes_per_pixel(mode)
+
+    out_w, out_h = int(width * percent / 100), int(height * percent / 100)
+    decoded_w, decoded_h = width, height
+    if DECODED.enabled:
+        bpp = 1 if mode in ("1", "L") else 4
+    elif image_format == "JPEG":
+        needed = (int(width * min(100, percent * tolerance) / 100), int(height * min(100, percent * tolerance) / 100))
+        scale = jpeg_draft_scale((width, height), needed)
+        decoded_w, decoded_h = -(-width // scale), -(-height // scale)
+
+    decoded = decoded_w * decoded_h * bpp
+    resized = out_w * out_h * bpp
+    return int(decoded + resized * (1 + ENCODER_OVERHEAD.get(fmt, 2.0)))
+
+
+def available_memory_bytes():
+    """MemAvailable from /proc/meminfo, or None where that isn't readable."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def resolve_budget(budget_mb=None):
+    """Budget in bytes: the configured MiB, else a share of available RAM, else None (unbounded)."""
+    if budget_mb:
+        return int(budget_mb * 2**20)
+    available = available_memory_bytes()
+    return int(available * AUTO_BUDGET_FRACTION) if available else None
+
+
+def reset_peak_rss():
+    """Resets this process's peak RSS (VmHWM) so the next reading covers one job. Linux only."""
+    try:
+        with open(f"/proc/{os.getpid()}/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_bytes():
+    """Peak RSS since the last reset_peak_rss() (Linux), else over the process lifetime."""
+    try:
+        with open(f"/proc/{os.getpid()}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class BudgetScheduler:
+    """
+    Submits `fn(*job)` to `pool` only while the estimated bytes of the jobs
+    in flight stay within `budget`. Jobs that fit are admitted out of order
+    rather than letting one large original block the queue; a job larger than
+    the whole budget runs alone. Jobs can be added at any time, so a
+    long-running caller (watch mode) shares one budget across events.
+    """
+
+    def __init__(self, pool, fn, estimate, budget, max_in_flight):
+        self.pool = pool
+        self.fn = fn
+        self.estimate = estimate
+        self.budget = budget
+        self.max_in_flight = max_in_flight
+        self.pending = []
+        self.in_flight = {}
+        self.used = 0
+
+    @property
+    def busy(self):
+        return bool(self.pending or self.in_flight)
+
+    def add(self, jobs):
+        self.pending.extend((job, self.estimate(job)) for job in jobs)
+        self._admit()
+
+    def _admit(self):
+        i = 0
+        while i < len(self.pending) and len(self.in_flight) < self.max_in_flight:
+            job, cost = self.pending[i]
+            if self.budget is None or self.used + cost <= self.budget or not self.in_flight:
+                self.pending.pop(i)
+                self.in_flight[self.pool.submit(self.fn, *job)] = (job, cost)
+                self.used += cost
+            else:
+                i += 1
+
+    def finished(self, timeout=None):
+        """
+        (job, future) pairs that finished within `timeout` seconds (None waits
+        for at least one), admitting waiting jobs into the freed budget.
+        """
+        if not self.in_flight:
+            return []
+        done, _ = wait(self.in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+        finished = []
+        for future in done:
+            job, cost = self.in_flight.pop(future)
+            self.used -= cost
+            finished.append((job, future))
+        self._admit()
+        return finished
+
+    def cancel(self):
+        """Drops the waiting jobs and cancels those not yet started."""
+        self.pending.clear()
+        for future in self.in_flight:
+            future.cancel()
+
+
+def run_within_budget(pool, fn, jobs, estimate, budget, max_in_flight):
+    """
+    Runs every job through a BudgetScheduler and yields (job, future) as
+    they finish.
+    """
+    scheduler = BudgetScheduler(pool, fn, estimate, budget, max_in_flight)
+    scheduler.add(jobs)
+    while scheduler.busy:
+        yield from scheduler.finished()
@@ -0,0 +1,190 @@
+# optimize_images.py
+
+import os
+import sys
+import struct
+import shutil
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from PIL import Image, ImageChops
+
+from build_manifest import BuildLock, BuildLocked, BuildManifest, DEFAULT_MANIFEST_PATH
+from catalog_graph import IMAGES_DIR
+from responsive_manifest import ResponsiveManifest
+
+# EXIF Orientation. Dropping it from a rotated photo would turn the image, so
+# such files keep their EXIF; everything else keeps only the ICC profile.
+_ORIENTATION = 0x0112
+
+
+def keeps_exif(img):
+    return img.getexif().get(_ORIENTATION, 1) != 1
+
+
+def webp_is_lossless(path):
+    """True for a still VP8L (lossless) WebP; lossy and animated files can't be re-encoded without changing pixels."""
+    data = Path(path).read_bytes()
+    if data[:4] != b"RIFF" or data[8:12] != b"WEBP":
+        return False
+    offset = 12
+    lossless = False
+    while offset + 8 <= len(data):
+        fourcc, size = struct.unpack_from("<4sI", data, offset)
+        if fourcc in (b"VP8 ", b"ANIM", b"ANMF"):
+            return False
+        if fourcc == b"VP8L":
+            lossless = True
+        offset += 8 + size + (size & 1)
+    return lossless
+
+
+def pixels_identical(a_path, b_path):
+    """True if both files decode to exactly the same pixels."""
+    with Image.open(a_path) as a, Image.open(b_path) as b:
+        if a.size != b.size or a.mode != b.mode:
+            return False
+        if a.mode not in ("L", "RGB", "RGBA"):
+            # ImageChops only compares these modes; CMYK JPEGs compare via raw bytes
+            return a.tobytes() == b.tobytes()
+        return ImageChops.difference(a, b).getbbox() is None
+
+
+def jpegtran_available():
+    return shutil.which("jpegtran") is not None
+
+
+def rewrite_jpeg(path, out_path):
+    """
+    Huffman-optimized progressive copy of a JPEG via jpegtran, which rewrites
+    the DCT coefficients as they are and so is lossless by construction.
+    """
+    with Image.open(path) as img:
+        keep_exif = keeps_exif(img)
+    command = ["jpegtran", "-copy", "all" if keep_exif else "icc", "-optimize", "-progressive",
+               "-outfile", str(out_path), str(path)]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"jpegtran failed: {result.stderr.strip()}")
+
+
+def rewrite_webp(path, out_path):
+    """Lossless WebP at the slowest, smallest method; returns False if the file is lossy."""
+    if not webp_is_lossless(path):
+        return False
+    with Image.open(path) as img:
+        options = {"lossless": True, "quality": 100, "method": 6, "exact": True}
+        if img.info.get("icc_profile"):
+            options["icc_profile"] = img.info["icc_profile"]
+        img.save(out_path, "WEBP", **options)
+    return True
+
+
+def optimize_file(path, dry_run=False):
+    """
+    Rewrites one file and swaps it in only if it is smaller and decodes to
+    identical pixels. Returns (status, old bytes, new bytes); status is
+    "optimized", "not smaller", "pixels differ", "lossy webp", "no jpegtran"
+    or "error: ...".
+    """
+    path = Path(path)
+    old_size = path.stat().st_size
+    is_jpeg = path.suffix.lower() in (".jpg", ".jpeg")
+    if is_jpeg and not jpegtran_available():
+        # Re-encoding decoded pixels is never lossless; without jpegtran there is nothing to do
+        return "no jpegtran", old_size, old_size
+    tmp_path = path.with_name(f".{path.stem}.{os.getpid()}.opt{path.suffix}")
+    try:
+        if is_jpeg:
+            rewrite_jpeg(path, tmp_path)
+        elif not rewrite_webp(path, tmp_path):
+            return "lossy webp", old_size, old_size
+        new_size = tmp_path.stat().st_size
+        if new_size >= old_size:
+            return "not smaller", old_size, new_size
+        if not pixels_identical(path, tmp_path):
+            return "pixels differ", old_size, new_size
+        if not dry_run:
+            os.replace(tmp_path, path)
+        return "optimized", old_size, new_size
+    except Exception as e:
+        return f"error: {e}", old_size, old_size
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def optimize_directory(directory=IMAGES_DIR, manifest=None, dry_run=False, workers=None):
+    """
+    Losslessly re-optimizes every JPEG and WebP under `directory`. Build-manifest
+    entries of rewritten outputs are updated, so they aren't mistaken for
+    hand-edited sources, and so are the byte sizes in the srcset manifest.
+
+    Returns {path: (status, old bytes, new bytes)}.
+    """
+    directory = Path(directory)
+    paths = sorted(p for p in directory.rglob("*")
+                   if p.is_file() and p.suffix.lower() in (".jpg", ".jpeg", ".webp") and not p.name.startswith("."))
+    # Decided before rewriting: afterwards no output matches its recorded hash
+    generated = {p for p in paths if manifest is not None and manifest.is_generated(p)}
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        results = dict(zip(paths, pool.map(lambda p: optimize_file(p, dry_run), paths)))
+
+    if not dry_run:
+        optimized = [p for p, (status, _, _) in results.items() if status == "optimized"]
+        if manifest is not None:
+            for path in optimized:
+                if path in generated:
+                    manifest.update_output(path)
+            manifest.save()
+        responsive_path = directory / "manifest.json"
+        if optimized and responsive_path.exists():
+            responsive = ResponsiveManifest(responsive_path, public_dir=directory.parent)
+            for path in optimized:
+                responsive.refresh(path)
+            responsive.save()
+    return results
+
+
+def print_summary(results, directory, dry_run=False):
+    counts = {}
+    if any(status == "no jpegtran" for status, _, _ in results.values()):
+        print("  jpegtran not found, JPEGs skipped (install libjpeg-turbo's jpegtran to optimize them)")
+    for path, (status, old_size, new_size) in results.items():
+        counts[status] = counts.get(status, 0) + 1
+        if status == "optimized":
+            print(f"  {Path(path).relative_to(directory)}: {old_size / 1024:.0f} -> {new_size / 1024:.0f} KiB")
+        elif status.startswith("error"):
+            print(f"  {Path(path).relative_to(directory)}: {status}")
+    saved = sum(old - new for status, old, new in results.values() if status == "optimized")
+    verb = "Would save" if dry_run else "Saved"
+    print(f"{verb} {saved / 1024:.0f} KiB across {counts.get('optimized', 0)} of {len(results)} files "
+          f"({', '.join(f'{n} {s}' for s, n in sorted(counts.items()))}).")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Losslessly re-optimize JPEG and WebP files in place")
+    parser.add_argument("--target", "-t", type=str, default=str(IMAGES_DIR), help="Images directory")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be saved")
+    parser.add_argument("--manifest", type=str, default=str(DEFAULT_MANIFEST_PATH), help="Build manifest to keep in step")
+    parser.add_argument("--no-manifest", action="store_true", help="Don't update the build manifest")
+    args = parser.parse_args(argv)
+
+    target = Path(args.target)
+    manifest = None if args.no_manifest else BuildManifest(args.manifest)
+    if manifest is not None and not args.dry_run:
+        lock = BuildLock(args.manifest)  # held until the script exits
+        try:
+            lock.acquire()
+        except BuildLocked as e:
+            print(f"Error: {e} on {args.manifest}.")
+            sys.exit(1)
+    results = optimize_directory(target, manifest, dry_run=args.dry_run)
+    print_summary(results, target, args.dry_run)
+    if any(status == "no jpegtran" for status, _, _ in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+# page_weight_audit.py
+
+import sys
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from PIL import Image
+
+from build_manifest import atomic_write_json
+from catalog_graph import IMAGE_EXTENSIONS, IMAGES_DIR, SHARED_DIRS, product_pages, source_stem
+from responsive_manifest import FORMATS
+
+# --- Configuration ---
+# Image pixels each device needs for the product page's main image
+# (CSS width × device pixel ratio). The smallest variant at least this wide
+# is what a srcset would pick; if none is, the widest one.
+DEVICE_WIDTHS = {"mobile": 780, "tablet": 1200, "desktop": 1280}
+
+# Formats in the order a browser that supports them would prefer.
+PAGE_FORMATS = ("avif", "webp", "jpeg")
+
+# Default budgets, in KiB.
+PAGE_BUDGET_KB = 1500     # All images of one product page, per format and device
+VARIANT_BUDGET_KB = 400   # Any single file
+
+# Files read at once. Only headers are read, so this is I/O bound.
+WORKERS = 16
+# --- End of Configuration ---
+
+
+def read_variant(path):
+    """(path, format, width, height, bytes) from the file header; width/height are None if unreadable."""
+    size = path.stat().st_size
+    fmt = FORMATS.get(path.suffix.lower(), path.suffix.lower().lstrip("."))
+    try:
+        with Image.open(path) as img:
+            width, height = img.size
+    except Exception:
+        width = height = None
+    return path, fmt, width, height, size
+
+
+def scan_variants(pages, images_dir=IMAGES_DIR, workers=WORKERS):
+    """
+    {stem: [variant dicts]} for every file under `images_dir` that belongs to a
+    stem used on any page, headers read in parallel.
+    """
+    referenced = {stem for stems in pages.values() for stem in stems}
+    images_dir = Path(images_dir)
+    paths = []
+    for path in images_dir.rglob("*"):
+        if not path.is_file() or path.suffix.lower() not in IMAGE_EXTENSIONS:
+            continue
+        if any(part in SHARED_DIRS for part in path.relative_to(images_dir).parts[:-1]):
+            continue
+        if source_stem(path.stem, referenced) is not None:
+            paths.append(path)
+
+    variants = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for path, fmt, width, height, size in pool.map(read_variant, paths):
+            variants.setdefault(source_stem(path.stem, referenced), []).append({
+                "path": str(path.relative_to(images_dir)).replace("\\", "/"),
+                "format": fmt, "width": width, "height": height, "bytes": size,
+            })
+    return variants
+
+
+def pick_variant(variants, fmt, width):
+    """The variant of `fmt` a srcset would serve for `width` pixels, or None."""
+    candidates = [v for v in variants if v["format"] == fmt and v["width"]]
+    if not candidates:
+        return None
+    wide_enough = [v for v in candidates if v["width"] >= width]
+    if wide_enough:
+        return min(wide_enough, key=lambda v: (v["width"], v["bytes"]))
+    return max(candidates, key=lambda v: (v["width"], -v["bytes"]))
+
+
+def page_weights(pages, variants):
+    """
+    {page: {format: {device: bytes}}}. A stem without the format falls back
+    to its JPEG, as the <picture> fallback would; missing stems count 0.
+    """
+    weights = {}
+    for page, stems in pages.items():
+        per_format = weights[page] = {}
+        for fmt in PAGE_FORMATS:
+            per_device = per_format[fmt] = {}
+            for device, width in DEVICE_WIDTHS.items():
+                total = 0
+                for stem in stems:
+                    chosen = pick_variant(variants.get(stem, []), fmt, width) or \
+                        pick_variant(variants.get(stem, []), "jpeg", width)
+                    total += chosen["bytes"] if chosen else 0
+                per_device[device] = total
+    return weights
+
+
+def find_problems(pages, variants, weights, page_budget, variant_budget):
+    """Every budget or coverage problem, as (kind, subject, detail) tuples."""
+    problems = []
+    for page, stems in pages.items():
+        for stem in stems:
+            if stem not in variants:
+                problems.append(("missing", stem, f"referenced on {page} but no file exists"))
+    for stem, stem_variants in sorted(variants.items()):
+        formats = {v["format"] for v in stem_variants}
+        for fmt in ("avif", "webp"):
+            if fmt not in formats:
+                problems.append(("no-" + fmt, stem, f"no {fmt} variant (has {', '.join(sorted(formats))})"))
+        for v in stem_variants:
+            if v["width"] is None:
+                problems.append(("unreadable", v["path"], "header could not be read"))
+            if v["bytes"] > variant_budget:
+                problems.append(("variant-over-budget", v["path"],
+                                 f"{v['bytes'] / 1024:.0f} KiB > {variant_budget / 1024:.0f} KiB"))
+        # A modern format that comes out bigger than the JPEG of the same size is not worth serving
+        jpeg_sizes = {(v["width"], v["height"]): v["bytes"] for v in stem_variants if v["format"] == "jpeg"}
+        for v in stem_variants:
+            jpeg = jpeg_sizes.get((v["width"], v["height"]))
+            if v["format"] in ("avif", "webp") and jpeg and v["bytes"] > jpeg:
+                problems.append(("larger-than-jpeg", v["path"], f"{v['bytes'] / 1024:.0f} KiB vs JPEG {jpeg / 1024:.0f} KiB"))
+    # Every format is served to some browser, so each must fit, not just the preferred one
+    for page, per_format in weights.items():
+        for fmt in PAGE_FORMATS:
+            for device, total in per_format[fmt].items():
+                if total > page_budget:
+                    problems.append(("page-over-budget", page,
+                                     f"{device} ({fmt}): {total / 1024:.0f} KiB > {page_budget / 1024:.0f} KiB"))
+    return problems
+
+
+def print_report(weights, problems):
+    devices = list(DEVICE_WIDTHS)
+    print(f"Bytes per product page (KiB), devices: {', '.join(f'{d} {w}px' for d, w in DEVICE_WIDTHS.items())}")
+    header = f"  {'page':<16}" + "".join(f"{fmt + ' ' + d:>16}" for fmt in PAGE_FORMATS for d in devices)
+    print(header)
+    for page, per_format in weights.items():
+        row = "".join(f"{per_format[fmt][d] / 1024:>16.0f}" for fmt in PAGE_FORMATS for d in devices)
+        print(f"  {page:<16}{row}")
+    if problems:
+        print(f"\n{len(problems)} problem(s):")
+        for kind, subject, detail in problems:
+            print(f"  [{kind}] {subject}: {detail}")
+    else:
+        print("\nAll pages and variants within budget.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Audit image bytes per product page against a budget")
+    parser.add_argument("--images", type=str, default=str(IMAGES_DIR), help="Images directory to audit")
+    parser.add_argument("--page-budget", type=int, default=PAGE_BUDGET_KB, help="KiB per product page")
+    parser.add_argument("--variant-budget", type=int, default=VARIANT_BUDGET_KB, help="KiB per image file")
+    parser.add_argument("--json", type=str, default=None, help="Also write the full report to this file")
+    parser.add_argument("--warn-only", action="store_true", help="Report problems but exit 0")
+    args = parser.parse_args(argv)
+
+    pages = product_pages()
+    variants = scan_variants(pages, args.images)
+    weights = page_weights(pages, variants)
+    problems = find_problems(pages, variants, weights, args.page_budget * 1024, args.variant_budget * 1024)
+    print_report(weights, problems)
+
+    if args.json:
+        atomic_write_json(args.json, {
+            "devices": DEVICE_WIDTHS,
+            "pages": weights,
+            "variants": variants,
+            "problems": [{"kind": k, "subject": s, "detail": d} for k, s, d in problems],
+        })
+    if problems and not args.warn_only:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# pipeline_trace.py
+
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+from build_manifest import atomic_write_json
+
+try:
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+
+def current_rss_bytes():
+    """Resident set size right now, from /proc/self/statm (Linux); None elsewhere."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Tracer:
+    """
+    Records timed spans as Chrome trace events ("X" complete events, plus an
+    RSS counter sampled at the end of every span). Disabled tracers cost one
+    attribute check per span, so instrumentation can stay in the code.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+
+    def enable(self):
+        self.enabled = True
+
+    @contextmanager
+    def span(self, name, cat="pipeline", **args):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            end = time.perf_counter_ns()
+            pid = os.getpid()
+            self.events.append({
+                "name": name, "cat": cat, "ph": "X", "pid": pid, "tid": threading.get_native_id(),
+                "ts": start / 1000, "dur": (end - start) / 1000, "args": args,
+            })
+            rss = current_rss_bytes()
+            if rss is not None:
+                self.events.append({"name": "RSS", "ph": "C", "pid": pid, "ts": end / 1000,
+                                    "args": {"MiB": round(rss / 2**20, 1)}})
+
+    def record(self, name, start_ns, end_ns, cat="pipeline", **args):
+        """
+        Adds a span whose times (perf_counter_ns) were measured some other
+        way, e.g. per file inside one external process. No RSS sample.
+        """
+        if not self.enabled:
+            return
+        self.events.append({
+            "name": name, "cat": cat, "ph": "X", "pid": os.getpid(), "tid": threading.get_native_id(),
+            "ts": start_ns / 1000, "dur": max(0, end_ns - start_ns) / 1000, "args": args,
+        })
+
+    def drain(self):
+        """Returns and clears the recorded events (e.g. to ship them from a worker)."""
+        events, self.events = self.events, []
+        return events
+
+    def extend(self, events):
+        self.events.extend(events or [])
+
+    def export(self, path):
+        """Writes everything recorded so far as a Chrome trace-event JSON file."""
+        atomic_write_json(path, {"traceEvents": self.events, "displayTimeUnit": "ms"})
+
+
+# One tracer per process; pipeline modules record into it.
+TRACER = Tracer()
+
+
+def summarize(events):
+    """
+    Aggregates span events into (stages, images): stages maps span name to
+    {count, total_ms, max_ms}, images maps the `image` arg to total ms.
+    """
+    stages = {}
+    images = {}
+    for event in events:
+        if event.get("ph") != "X":
+            continue
+        ms = event["dur"] / 1000
+        stage = stages.setdefault(event["name"], {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+        stage["count"] += 1
+        stage["total_ms"] += ms
+        stage["max_ms"] = max(stage["max_ms"], ms)
+        image = event.get("args", {}).get("image")
+        if image:
+            images[image] = images.get(image, 0.0) + ms
+    return stages, images
@@ -0,0 +1,111 @@
+# placeholders.py
+
+import io
+import math
+import base64
+from PIL import Image
+
+# --- Placeholder settings ---
+BLURHASH_COMPONENTS = (4, 3)  # (x, y) DCT components; 4×3 suits product photos
+BLURHASH_SAMPLE = 32          # Blurhash is computed on at most a 32px image
+LQIP_SIZE = 20                # Longest side of the inline WebP, in pixels
+LQIP_QUALITY = 40
+DOMINANT_COLOURS = 5          # Palette size when picking the dominant colour
+
+_BASE83 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+
+
+def _encode83(value, length):
+    return "".join(_BASE83[(value // 83 ** (length - i)) % 83] for i in range(1, length + 1))
+
+
+def _srgb_to_linear(value):
+    v = value / 255
+    return v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+
+
+def _linear_to_srgb(value):
+    v = max(0.0, min(1.0, value))
+    if v <= 0.0031308:
+        return int(v * 12.92 * 255 + 0.5)
+    return int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def _sign_pow(value, exponent):
+    return math.copysign(abs(value) ** exponent, value)
+
+
+def blurhash(img, components=BLURHASH_COMPONENTS):
+    """Encodes an image as a blurhash string (https://blurha.sh)."""
+    x_components, y_components = components
+    small = img.convert("RGB")
+    small.thumbnail((BLURHASH_SAMPLE, BLURHASH_SAMPLE), Image.Resampling.BOX)
+    width, height = small.size
+    lut = [_srgb_to_linear(v) for v in range(256)]
+    data = small.tobytes()
+    pixels = [(lut[data[i]], lut[data[i + 1]], lut[data[i + 2]]) for i in range(0, len(data), 3)]
+
+    factors = []
+    for j in range(y_components):
+        cos_y = [math.cos(math.pi * j * y / height) for y in range(height)]
+        for i in range(x_components):
+            cos_x = [math.cos(math.pi * i * x / width) for x in range(width)]
+            norm = 1 if i == 0 and j == 0 else 2
+            r = g = b = 0.0
+            for y in range(height):
+                row = y * width
+                for x in range(width):
+                    basis = cos_x[x] * cos_y[y]
+                    pr, pg, pb = pixels[row + x]
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            scale = norm / (width * height)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    result = _encode83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        actual_max = max(abs(v) for factor in ac for v in factor)
+        quantised_max = max(0, min(82, int(math.floor(actual_max * 166 - 0.5))))
+        max_value = (quantised_max + 1) / 166
+    else:
+        quantised_max, max_value = 0, 1
+    result += _encode83(quantised_max, 1)
+    result += _encode83((_linear_to_srgb(dc[0]) << 16) + (_linear_to_srgb(dc[1]) << 8) + _linear_to_srgb(dc[2]), 4)
+    for factor in ac:
+        q = [max(0, min(18, int(math.floor(_sign_pow(v / max_value, 0.5) * 9 + 9.5)))) for v in factor]
+        result += _encode83(q[0] * 19 * 19 + q[1] * 19 + q[2], 2)
+    return result
+
+
+def lqip_data_uri(img, size=LQIP_SIZE, quality=LQIP_QUALITY):
+    """A ~20px WebP of the image as a base64 data: URI, small enough to inline."""
+    tiny = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+    tiny.thumbnail((size, size), Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    tiny.save(buffer, "webp", quality=quality)
+    return "data:image/webp;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def dominant_colour(img, colours=DOMINANT_COLOURS):
+    """Most common colour after quantising to a small palette, as #rrggbb."""
+    small = img.convert("RGB").resize((64, 64), Image.Resampling.BOX)
+    quantised = small.quantize(colours, method=Image.Quantize.MEDIANCUT)
+    _, index = max(quantised.getcolors())
+    r, g, b = quantised.getpalette()[index * 3:index * 3 + 3]
+    return f"#{r:02x}{g:02x}{b:02x}"
+
+
+def make_placeholder(img):
+    """
+    Everything the storefront needs to paint a product image before it loads.
+    `img` should be an already decoded (ideally thumbnail-sized) image.
+    """
+    return {
+        "blurhash": blurhash(img),
+        "lqip": lqip_data_uri(img),
+        "color": dominant_colour(img),
+        "width": img.size[0],
+        "height": img.size[1],
+    }
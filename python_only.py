@@ -1,9 +1,28 @@
 # process_images.py
 
 import os
+import sys
+import argparse
+import subprocess
+from dataclasses import replace
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from PIL import Image
 
+from build_manifest import BuildLock, BuildLocked, BuildManifest, DEFAULT_MANIFEST_PATH, atomic_output, source_hash
+from catalog_graph import build_graph, find_orphans, is_alias_variant, order_by_catalog
+from decoded_cache import DECODED
+from image_dedupe import aliases_from_clusters, find_clusters
+from encoders import DEFAULT_ROUTING_PATH, PillowBackend, VariantSpec, backend_for, load_routing
+from memory_scheduler import (BudgetScheduler, estimate_job_bytes, peak_rss_bytes, reset_peak_rss, resolve_budget,
+                              run_within_budget)
+from pipeline_trace import TRACER, summarize
+from placeholders import make_placeholder
+from responsive_manifest import DEFAULT_RESPONSIVE_MANIFEST_PATH, ResponsiveManifest
+from resize_planner import compare_with_direct, resize_cascade, resize_one
+from watch_images import iter_changes, make_watcher
+
 # For beautiful terminal output
 from rich.console import Console
 from rich.progress import Progress
@@ -19,7 +38,21 @@ CONFIG = {
     "thumb_percentage": 10,  # 10% size for thumbnails
     "webp_quality": 70,      # Quality for WebP images (0-100)
     "avif_quality": 60,      # Quality for AVIF images (0-100, lower is better but smaller)
-    "avif_speed": 6          # AVIF encoding speed (0-10, 10 is fastest but lower quality)
+    "jpeg_quality": 85,      # Quality for JPEG fallbacks (served by image_server.py; also used to calibrate JPEG encoders)
+    "avif_speed": 6,         # AVIF encoding speed (0-10, 10 is fastest but lower quality)
+    "avif_phase_speed": 4,   # AVIF speed when AVIF is its own phase (--phase avif / --two-phase): slower, smaller files
+    "avif_phase_log": "./.image-build-avif.log",  # Output of the background AVIF phase started by --two-phase
+    "resize_tolerance": 2.0, # Min source/target ratio for deriving a size from a larger one (higher = closer to direct LANCZOS)
+    "jobs": 1,               # Parallel encode workers (1 = serial, 0 = one per CPU core)
+    "manifest_path": str(DEFAULT_MANIFEST_PATH),  # Records what was built from what, for incremental runs
+    "routing_path": str(DEFAULT_ROUTING_PATH),    # Format -> encoder backend, written by `encoders.py --calibrate`
+    "target_ssim": None,     # e.g. 0.95: search the lowest quality per image that meets this SSIM (None = fixed qualities)
+    "responsive_manifest_path": str(DEFAULT_RESPONSIVE_MANIFEST_PATH),  # Variant list for srcset, served at /images/manifest.json
+    "placeholders": True,    # Blurhash, ~20px WebP and dominant colour per image, computed from the thumbnail
+    "memory_budget_mb": None,  # RAM budget for parallel jobs, estimated from image headers (None = 75% of available)
+    "trace_path": None,      # Write a Chrome trace (chrome://tracing, Perfetto) of every stage to this file
+    "decoded_cache": False,  # Keep decoded sources as memory-mapped raw buffers in .decoded-cache/, shared by workers and runs
+    "dedupe": False          # Encode near-identical sources (perceptual hash) once and alias the rest in the srcset manifest
 }
 # --- END CONFIGURATION ---
 
@@ -32,53 +65,573 @@ def create_output_dirs(base_path, subdirs):
     for subdir in subdirs:
         Path(os.path.join(base_path, subdir)).mkdir(exist_ok=True)
 
-def process_image(file_path, progress, task_id):
+def plan_workers(jobs, cpu_count=None):
     """
-    Processes a single image: resizes it, creates WebP/AVIF variants, and a thumbnail.
+    Splits the available cores between parallel encode workers and the AVIF
+    encoder's own threads so the machine is never oversubscribed.
+
+    Returns (workers, avif_threads).
+    """
+    cpu_count = cpu_count or os.cpu_count() or 1
+    workers = cpu_count if jobs <= 0 else min(jobs, cpu_count)
+    avif_threads = max(1, cpu_count // workers)
+    return workers, avif_threads
+
+def build_jobs(image_files):
+    """
+    Expands every image into its (image, size, format) encode jobs.
+    A size of None is the thumbnail, which is only written as WebP.
+    """
+    jobs = []
+    for file_path in image_files:
+        jobs.append((file_path, None, "webp"))
+        for percent in CONFIG["resize_percentages"]:
+            jobs.append((file_path, percent, "webp"))
+            jobs.append((file_path, percent, "avif"))
+    return jobs
+
+def phase_jobs(jobs, phase):
+    """
+    Keeps the jobs of one build phase: "preview" is every WebP variant and
+    thumbnail (enough to deploy), "avif" the slow AVIF variants, "all" both.
+    """
+    if phase == "preview":
+        return [job for job in jobs if job[2] != "avif"]
+    if phase == "avif":
+        return [job for job in jobs if job[2] == "avif"]
+    return jobs
+
+def variant_path(file_path, percent, fmt):
+    """Output path of a variant, e.g. webp/image_75.webp or webp/image_thumb.webp."""
+    size_suffix = "_thumb" if percent is None else f"_{percent}"
+    return os.path.join(CONFIG["output_dir"], fmt, f"{Path(file_path).stem}{size_suffix}.{fmt}")
+
+@lru_cache(maxsize=None)
+def encoder_for(fmt):
+    """The encoder backend calibrated for `fmt` (Pillow unless routed elsewhere)."""
+    return backend_for(fmt, load_routing(CONFIG["routing_path"]))
+
+def variant_spec(fmt, width, height):
+    """The shared encoder spec for one output of this pipeline."""
+    if fmt == "avif":
+        return VariantSpec(fmt, width, height, CONFIG["avif_quality"], CONFIG["avif_speed"])
+    if fmt == "jpeg":
+        return VariantSpec(fmt, width, height, CONFIG["jpeg_quality"])
+    return VariantSpec(fmt, width, height, CONFIG["webp_quality"])
+
+def variant_settings(percent, fmt):
+    """Encoder settings that, together with the source content, determine a variant's bytes."""
+    settings = {
+        "format": fmt,
+        "resize_percentage": CONFIG["thumb_percentage"] if percent is None else percent,
+        # Sets the draft scale and resize cascade, so it changes the pixels too
+        "resize_tolerance": CONFIG["resize_tolerance"],
+    }
+    if fmt == "avif":
+        settings.update(quality=CONFIG["avif_quality"], speed=CONFIG["avif_speed"])
+    else:
+        settings.update(quality=CONFIG["webp_quality"])
+    backend = encoder_for(fmt)
+    if backend.name != "pillow":
+        settings["backend"] = backend.name
+    elif CONFIG["target_ssim"]:
+        # Quality is chosen per image by the search
+        del settings["quality"]
+        settings["target_ssim"] = CONFIG["target_ssim"]
+    return settings
+
+def searched_spec(resized_img, file_path, spec, save_path):
+    """Swaps the fixed quality for the lowest one that meets CONFIG["target_ssim"]."""
+    # Imported here so the default fixed-quality mode doesn't need numpy
+    from quality_search import search_quality
+    options = {"speed": spec.speed} if spec.speed is not None else {}
+    quality, _ = search_quality(resized_img, spec.fmt, CONFIG["target_ssim"],
+                                source_hash(file_path), Path(save_path).name, **options)
+    return replace(spec, quality=quality)
+
+def resize_percentage(percent):
+    """Maps a job's size (None for the thumbnail) to its resize percentage."""
+    return CONFIG["thumb_percentage"] if percent is None else percent
+
+def save_variant(resized_img, file_path, percent, fmt, avif_threads=None):
+    """
+    Saves an already resized image as one variant, through the calibrated backend.
+    Returns a result dict; the thumbnail job also computes the image's placeholder
+    from the thumbnail it already has in memory.
+    """
+    result = {}
+    image = Path(file_path).name
+    if percent is None and CONFIG["placeholders"]:
+        with TRACER.span("placeholder", image=image):
+            result["placeholder"] = make_placeholder(resized_img)
+    save_path = variant_path(file_path, percent, fmt)
+    spec = variant_spec(fmt, *resized_img.size)
+    backend = encoder_for(fmt)
+    if backend.name == "pillow" and CONFIG["target_ssim"]:
+        with TRACER.span("quality search", image=image, fmt=fmt):
+            spec = searched_spec(resized_img, file_path, spec, save_path)
+    # Written to a temp file and renamed, so nothing ever serves a half-written variant
+    with TRACER.span(f"encode {fmt}", image=image, backend=backend.name, width=spec.width):
+        with atomic_output(save_path) as tmp_path:
+            if backend.name == "pillow":
+                PillowBackend(avif_threads).save(resized_img, tmp_path, spec)
+            else:
+                # External backends resize from the original themselves
+                backend.encode(file_path, tmp_path, spec)
+    result["path"] = save_path
+    return result
+
+def build_units(jobs):
+    """
+    Groups encode jobs into pool tasks of (image, size, formats), so every
+    size is decoded and resized once however many formats it is written in.
+    """
+    units = {}
+    for file_path, percent, fmt in jobs:
+        units.setdefault((file_path, percent), []).append(fmt)
+    return [(file_path, percent, tuple(fmts)) for (file_path, percent), fmts in units.items()]
+
+def encode_size(file_path, percent, fmts, avif_threads=None):
     """
+    Resizes a single image to one size and saves it in each of `fmts`.
+    Returns a list of (job, result, error); one format failing doesn't lose the others.
+    """
+    reset_peak_rss()
+    outcomes = []
     try:
-        with Image.open(file_path) as img:
-            original_width, original_height = img.size
-            file_stem = Path(file_path).stem # Filename without extension
+        # JPEGs are only decoded at the DCT scale this one size needs
+        with resize_one(file_path, resize_percentage(percent), CONFIG["resize_tolerance"]) as resized_img:
+            for fmt in fmts:
+                job = (file_path, percent, fmt)
+                try:
+                    outcomes.append((job, save_variant(resized_img, *job, avif_threads), None))
+                except Exception as e:
+                    outcomes.append((job, None, e))
+    except Exception as e:
+        # Decode or resize failed: every format still waiting on it fails with it
+        done = {job for job, _, _ in outcomes}
+        outcomes += [(job, None, e) for job in ((file_path, percent, fmt) for fmt in fmts) if job not in done]
+    peak = peak_rss_bytes()
+    results = [result for _, result, _ in outcomes if result is not None]
+    for result in results:
+        result["peak_rss"] = peak
+    if results:
+        # Spans recorded in this worker travel back with the results
+        results[0]["trace"] = TRACER.drain()
+    return outcomes
 
-            # 1. Generate Thumbnail (_thumb.webp)
-            thumb_width = int(original_width * (CONFIG["thumb_percentage"] / 100))
-            thumb_height = int(original_height * (CONFIG["thumb_percentage"] / 100))
-            thumb_img = img.resize((thumb_width, thumb_height), Image.Resampling.LANCZOS)
+def estimate_job(job):
+    """Estimated peak image memory of a job, from the source header only."""
+    file_path, percent, fmt = job
+    try:
+        return estimate_job_bytes(file_path, resize_percentage(percent), fmt, CONFIG["resize_tolerance"])
+    except OSError:
+        # Unreadable header: the job will fail fast in the worker anyway
+        return 0
 
-            thumb_filename = f"{file_stem}_thumb.webp"
-            thumb_save_path = os.path.join(CONFIG["output_dir"], "webp", thumb_filename)
-            thumb_img.save(thumb_save_path, "webp", quality=CONFIG["webp_quality"])
+def estimate_unit(unit):
+    """Formats of one size are encoded one after the other, so the heaviest one sets the peak."""
+    file_path, percent, fmts = unit
+    return max(estimate_job((file_path, percent, fmt)) for fmt in fmts)
 
-            # 2. Generate Resized WebP and AVIF variants
-            for percent in CONFIG["resize_percentages"]:
-                new_width = int(original_width * (percent / 100))
-                new_height = int(original_height * (percent / 100))
+def encode_image(file_path, jobs, avif_threads=None):
+    """
+    Decodes an image once and encodes all of its jobs, deriving the smaller
+    sizes from larger intermediates. Yields (job, result, error) as each one finishes.
+    """
+    by_percent = {}
+    for job in jobs:
+        by_percent.setdefault(resize_percentage(job[1]), []).append(job)
+    remaining = list(jobs)
+    try:
+        for percent, resized_img in resize_cascade(file_path, list(by_percent), CONFIG["resize_tolerance"]):
+            for job in by_percent[percent]:
+                remaining.remove(job)
+                try:
+                    result = save_variant(resized_img, *job, avif_threads)
+                except Exception as e:
+                    yield job, None, e
+                else:
+                    yield job, result, None
+    except Exception as e:
+        # Decode or resize failed: every job still waiting on this image fails with it
+        for job in remaining:
+            yield job, None, e
 
-                # Suffix for the filename, e.g., _75
-                size_suffix = f"_{percent}"
+def accepted_settings(percent, fmt):
+    """
+    Every recorded settings a variant may have been built with and still be
+    current. AVIF from a slower speed than ours (the AVIF phase's) is at least
+    as good, so a default run keeps it rather than re-encoding it faster.
+    """
+    settings = variant_settings(percent, fmt)
+    if fmt != "avif":
+        return [settings]
+    speeds = {CONFIG["avif_speed"], CONFIG["avif_phase_speed"]}
+    return [{**settings, "speed": speed} for speed in sorted(speeds) if speed <= CONFIG["avif_speed"]]
 
-                resized_img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+def filter_stale_jobs(jobs, manifest):
+    """Drops jobs whose output is already up to date with its source and settings."""
+    return [
+        job for job in jobs
+        if not any(manifest.is_fresh(variant_path(*job), manifest.hash(job[0]), settings)
+                   for settings in accepted_settings(*job[1:]))
+    ]
 
-                # Save as WebP
-                webp_filename = f"{file_stem}{size_suffix}.webp"
-                webp_save_path = os.path.join(CONFIG["output_dir"], "webp", webp_filename)
-                resized_img.save(webp_save_path, "webp", quality=CONFIG["webp_quality"])
+def record_job(job, result, manifest, placeholders=None, peaks=None, src_hash=None):
+    """
+    Records a successfully written variant in the build manifest, its placeholder
+    and peak RSS. `src_hash` is the source hash the job was started from, when the
+    source may have changed since.
+    """
+    if manifest is not None:
+        src_hash = src_hash or manifest.hash(job[0])
+        manifest.record(variant_path(*job), job[0], src_hash, variant_settings(*job[1:]))
+    TRACER.extend(result.get("trace"))
+    if placeholders is not None and result.get("placeholder"):
+        placeholders[Path(job[0]).stem] = result["placeholder"]
+    if peaks is not None and result.get("peak_rss"):
+        name = Path(job[0]).name
+        peaks[name] = max(peaks.get(name, 0), result["peak_rss"])
 
-                # Save as AVIF
-                avif_filename = f"{file_stem}{size_suffix}.avif"
-                avif_save_path = os.path.join(CONFIG["output_dir"], "avif", avif_filename)
-                # AVIF uses different parameters: `quality` (lower is better) and `speed`
-                resized_img.save(avif_save_path, "avif", quality=CONFIG["avif_quality"], speed=CONFIG["avif_speed"])
+def process_image(file_path, progress, task_id, manifest=None):
+    """
+    Processes a single image: resizes it, creates WebP/AVIF variants, and a thumbnail.
+    """
+    jobs = build_jobs([file_path])
+    if manifest is not None:
+        jobs = filter_stale_jobs(jobs, manifest)
+    return run_serial(jobs, progress, task_id, manifest)
+
+def run_serial(jobs, progress, task_id, manifest=None, placeholders=None, peaks=None):
+    """Runs encode jobs in this process, decoding each image only once."""
+    by_image = {}
+    for job in jobs:
+        by_image.setdefault(job[0], []).append(job)
+
+    errors = []
+    for file_path, image_jobs in by_image.items():
+        reset_peak_rss()
+        for job, result, e in encode_image(file_path, image_jobs):
+            if e is None:
+                result["peak_rss"] = peak_rss_bytes()
+                record_job(job, result, manifest, placeholders, peaks)
+            else:
+                errors.append((job, e))
+                console.print(f"[bold red]Error processing {Path(job[0]).name}: {e}[/bold red]")
+            progress.update(task_id, advance=1)
+    return errors
+
+def init_worker(config):
+    """Applies the parent's CONFIG (including command-line overrides) in a pool worker."""
+    CONFIG.update(config)
+    # Forked workers inherit the parent's events; only ship back their own
+    TRACER.drain()
+    if CONFIG["trace_path"]:
+        TRACER.enable()
+    if CONFIG["decoded_cache"]:
+        DECODED.enable()
 
+def run_parallel(jobs, workers, avif_threads, progress, task_id, manifest=None, placeholders=None, peaks=None):
+    """
+    Runs encode jobs across a process pool, one task per image size, and
+    collects errors from every worker. Tasks are only admitted while their
+    estimated memory fits CONFIG["memory_budget_mb"].
+    """
+    errors = []
+    budget = resolve_budget(CONFIG["memory_budget_mb"])
+    units = [(*unit, avif_threads) for unit in build_units(jobs)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(dict(CONFIG),)) as pool:
+        finished = run_within_budget(pool, encode_size, units, lambda unit: estimate_unit(unit[:3]), budget, workers)
+        for unit, future in finished:
+            for job, result, e in unit_outcomes(unit, future):
+                if e is None:
+                    try:
+                        record_job(job, result, manifest, placeholders, peaks)
+                    except Exception as record_error:
+                        e = record_error
+                if e is not None:
+                    errors.append((job, e))
+                progress.update(task_id, advance=1)
+    return errors
+
+def unit_outcomes(unit, future):
+    """A finished task's (job, result, error) list; if the worker itself died, every format failed."""
+    file_path, percent, fmts = unit[:3]
+    try:
+        return future.result()
     except Exception as e:
-        console.print(f"[bold red]Error processing {file_path.name}: {e}[/bold red]")
-    finally:
-        progress.update(task_id, advance=1)
+        return [((file_path, percent, fmt), None, e) for fmt in fmts]
+
+def encode_changed(unit, src_hash):
+    """
+    encode_size for watch mode. `src_hash` only travels along, so each result
+    is recorded against the source version it was built from.
+    """
+    return encode_size(*unit)
+
+def watch(input_dir, workers, avif_threads, manifest, polling=False, debounce=0.5, graph=None, aliases=None):
+    """
+    Re-encodes only the changed image's stale variants whenever a file in
+    `input_dir` is written, on a pool that stays up between events and within
+    the same memory budget as the initial build. With `graph` (--catalog) only
+    referenced images are encoded; aliased duplicates (--dedupe) are skipped.
+    Runs until interrupted with Ctrl+C.
+    """
+    aliases = aliases or {}
+    watcher = make_watcher(input_dir, polling)
+    console.print(f"[cyan]Watching '{input_dir}' ({watcher.kind}, {debounce}s debounce). Press Ctrl+C to stop.[/cyan]")
+    budget = resolve_budget(CONFIG["memory_budget_mb"])
+    remaining = {}   # source path -> number of its tasks queued or in flight
+    placeholders = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(dict(CONFIG),)) as pool:
+        scheduler = BudgetScheduler(pool, encode_changed, lambda task: estimate_unit(task[0][:3]), budget, workers)
+        try:
+            for changed in iter_changes(watcher, input_dir, debounce):
+                for file_path in sorted(changed):
+                    if file_path.suffix.lower() not in ['.jpg', '.jpeg', '.png']:
+                        continue
+                    if not file_path.exists():
+                        console.print(f"[yellow]{file_path.name} was removed; its variants are left in place.[/yellow]")
+                        continue
+                    if graph is not None and file_path.stem not in graph:
+                        console.print(f"[yellow]{file_path.name} is not referenced by the catalog; skipped.[/yellow]")
+                        continue
+                    if file_path.stem in aliases:
+                        console.print(f"[yellow]{file_path.name} is a duplicate of {aliases[file_path.stem]}; skipped "
+                                      f"(duplicates are re-checked when the build restarts).[/yellow]")
+                        continue
+                    manifest.invalidate(file_path)
+                    src_hash = manifest.hash(file_path)
+                    jobs = filter_stale_jobs(build_jobs([file_path]), manifest)
+                    console.print(f"[cyan]{file_path.name} changed: {len(jobs)} variant(s) to encode.[/cyan]")
+                    units = build_units(jobs)
+                    scheduler.add([((*unit, avif_threads), src_hash) for unit in units])
+                    remaining[file_path] = remaining.get(file_path, 0) + len(units)
+
+                for (unit, src_hash), future in scheduler.finished(timeout=0):
+                    for job, result, e in unit_outcomes(unit, future):
+                        if e is None:
+                            try:
+                                record_job(job, result, manifest, placeholders, src_hash=src_hash)
+                            except Exception as record_error:
+                                e = record_error
+                        if e is not None:
+                            console.print(f"[bold red]Error processing {Path(job[0]).name}: {e}[/bold red]")
+                    file_path = unit[0]
+                    remaining[file_path] -= 1
+                    if not remaining[file_path]:
+                        del remaining[file_path]
+                        manifest.save()
+                        update_responsive_manifest([file_path], placeholders=placeholders)
+                        console.print(f"[green]✅ {file_path.name} published.[/green]")
+        except KeyboardInterrupt:
+            console.print("\n[yellow]Stopping watch mode...[/yellow]")
+            scheduler.cancel()
+        finally:
+            manifest.save()
+
+def build_status(image_files, manifest):
+    """
+    How far the build of `image_files` got: servable once every preview variant
+    is up to date, complete once the AVIF variants are too.
+    """
+    jobs = build_jobs(image_files)
+    preview_pending = filter_stale_jobs(phase_jobs(jobs, "preview"), manifest)
+    avif_pending = filter_stale_jobs(phase_jobs(jobs, "avif"), manifest)
+    return {
+        "servable": not preview_pending,
+        "complete": not preview_pending and not avif_pending,
+        "avif_pending": len(avif_pending),
+    }
+
+def start_background_phase(args):
+    """
+    Starts `--phase avif` as a detached follow-up process, logging to
+    CONFIG["avif_phase_log"]. It gets every option that shapes the job list or
+    the encodes, and waits for the build lock rather than racing another build.
+    """
+    command = [sys.executable, os.path.abspath(__file__), "--phase", "avif", "--wait-for-lock", "--jobs", str(args.jobs)]
+    for flag, enabled in (("--force", args.force), ("--catalog", args.catalog), ("--dedupe", args.dedupe),
+                          ("--decoded-cache", args.decoded_cache)):
+        if enabled:
+            command.append(flag)
+    if args.target_ssim:
+        command += ["--target-ssim", str(args.target_ssim)]
+    if args.memory_budget:
+        command += ["--memory-budget", str(args.memory_budget)]
+    if args.trace:
+        # Its own file, so it doesn't overwrite the preview phase's trace
+        trace = Path(args.trace)
+        command += ["--trace", str(trace.with_name(f"{trace.stem}.avif{trace.suffix}"))]
+    with open(CONFIG["avif_phase_log"], "w") as log:
+        process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                                   start_new_session=True)
+    return process
+
+def dedupe_sources(image_files):
+    """
+    Clusters near-identical sources and keeps one per cluster.
+    Returns (files to encode, {alias stem: encoded stem}).
+    """
+    clusters = find_clusters(image_files)
+    aliases = aliases_from_clusters(clusters)
+    table = Table(title=f"{len(aliases)} duplicate source(s)")
+    table.add_column("Encoded", style="magenta")
+    table.add_column("Aliases", style="cyan")
+    for cluster in clusters:
+        if len(cluster) > 1:
+            table.add_row(cluster[0].name, ", ".join(p.name for p in cluster[1:]))
+    if aliases:
+        console.print(table)
+    keep = {cluster[0] for cluster in clusters}
+    # Unreadable files stay in, so they are still reported as errors
+    return [p for p in image_files if p in keep or p.stem not in aliases], aliases
+
+def update_responsive_manifest(image_files, errors=(), placeholders=None, status=None, aliases=None):
+    """
+    Lists every variant of `image_files` present on disk in the srcset manifest,
+    with placeholders and, if given, the build status and duplicate aliases.
+    """
+    failed = {job for job, _ in errors}
+    manifest = ResponsiveManifest(CONFIG["responsive_manifest_path"])
+    if status is not None:
+        manifest.set_build_status(**status)
+    if aliases is not None:
+        manifest.set_aliases(aliases)
+    for stem, placeholder in (placeholders or {}).items():
+        manifest.set_placeholder(stem, placeholder)
+    if CONFIG["placeholders"]:
+        # Thumbnails skipped as up to date: compute from the small file on disk, once
+        for file_path in image_files:
+            stem = Path(file_path).stem
+            thumb_path = Path(variant_path(file_path, None, "webp"))
+            if manifest.placeholder(stem) is None and thumb_path.exists():
+                with Image.open(thumb_path) as thumb:
+                    manifest.set_placeholder(stem, make_placeholder(thumb))
+    for job in build_jobs(image_files):
+        if job in failed:
+            continue
+        manifest.add(Path(job[0]).stem, variant_path(*job), "thumb" if job[1] is None else str(job[1]))
+    # Full-size files next to the variants (as produced by scripts/convert_images.py)
+    for file_path in image_files:
+        for ext in (".avif", ".webp", ".jpg"):
+            manifest.add(Path(file_path).stem, Path(CONFIG["output_dir"]) / f"{Path(file_path).stem}{ext}", "full")
+    manifest.save()
+
+def print_resize_comparison(image_files):
+    """Reports time and memory saved by the resize planner against the direct path."""
+    percentages = CONFIG["resize_percentages"] + [CONFIG["thumb_percentage"]]
+    table = Table(title=f"Resize planner vs direct LANCZOS (tolerance {CONFIG['resize_tolerance']})")
+    table.add_column("Image", style="magenta")
+    table.add_column("Direct", justify="right")
+    table.add_column("Planned", justify="right", style="green")
+    table.add_column("Peak pixels (direct → planned)", justify="right")
+    table.add_column("Per-size task MiB (direct → planned)", justify="right")
+    table.add_column("Worst PSNR", justify="right", style="cyan")
+    totals = [0.0, 0.0]
+    for file_path in image_files:
+        try:
+            r = compare_with_direct(file_path, percentages, CONFIG["resize_tolerance"])
+        except Exception as e:
+            console.print(f"[bold red]Error comparing {file_path.name}: {e}[/bold red]")
+            continue
+        totals[0] += r["direct_seconds"]
+        totals[1] += r["planned_seconds"]
+        table.add_row(
+            file_path.name,
+            f"{r['direct_seconds']:.2f}s",
+            f"{r['planned_seconds']:.2f}s",
+            f"{r['direct_peak_bytes'] / 2**20:.0f} → {r['planned_peak_bytes'] / 2**20:.0f} MiB",
+            "\n".join(f"{p}%: {direct / 2**20:.0f} → {planned / 2**20:.0f}"
+                      for p, (direct, planned) in r["size_peaks"].items()),
+            f"{r['worst_psnr']:.1f} dB",
+        )
+    table.add_row("[bold]Total[/bold]", f"{totals[0]:.2f}s", f"{totals[1]:.2f}s", "", "", "")
+    console.print(table)
+
+def print_peak_memory(peaks, limit=10):
+    """Prints the images with the highest peak RSS seen while encoding them."""
+    if not peaks:
+        return
+    table = Table(title="Peak RSS per image (highest first)")
+    table.add_column("Image", style="magenta")
+    table.add_column("Peak RSS", justify="right", style="cyan")
+    for name, peak in sorted(peaks.items(), key=lambda item: item[1], reverse=True)[:limit]:
+        table.add_row(name, f"{peak / 2**20:.0f} MiB")
+    console.print(table)
+
+def print_trace_summary(events, limit=10):
+    """Prints time per stage and the slowest images from the recorded trace."""
+    stages, images = summarize(events)
+    table = Table(title="Time per stage")
+    table.add_column("Stage", style="magenta")
+    table.add_column("Count", justify="right")
+    table.add_column("Total", justify="right", style="cyan")
+    table.add_column("Mean", justify="right")
+    table.add_column("Max", justify="right")
+    for name, stage in sorted(stages.items(), key=lambda item: item[1]["total_ms"], reverse=True):
+        table.add_row(name, str(stage["count"]), f"{stage['total_ms'] / 1000:.2f}s",
+                      f"{stage['total_ms'] / stage['count']:.0f}ms", f"{stage['max_ms']:.0f}ms")
+    console.print(table)
+
+    table = Table(title="Slowest images")
+    table.add_column("Image", style="magenta")
+    table.add_column("Time", justify="right", style="cyan")
+    for name, ms in sorted(images.items(), key=lambda item: item[1], reverse=True)[:limit]:
+        table.add_row(name, f"{ms / 1000:.2f}s")
+    console.print(table)
+
+def print_errors(errors):
+    """Prints a summary table of failed encode jobs."""
+    table = Table(title=f"[bold red]{len(errors)} variant(s) failed[/bold red]")
+    table.add_column("Image", style="magenta")
+    table.add_column("Variant", style="cyan")
+    table.add_column("Error", style="red")
+    for (file_path, percent, fmt), e in errors:
+        size = "thumb" if percent is None else f"{percent}%"
+        table.add_row(Path(file_path).name, f"{size} {fmt}", str(e))
+    console.print(table)
 
 
-def main():
+def main(argv=None):
     """Main function to run the image processing script."""
+    parser = argparse.ArgumentParser(description="Generate resized WebP/AVIF variants and thumbnails")
+    parser.add_argument("--jobs", "-j", type=int, default=CONFIG["jobs"],
+                        help="Parallel encode workers (1 = serial, 0 = one per CPU core)")
+    parser.add_argument("--force", action="store_true",
+                        help="Re-encode every variant, ignoring the build manifest")
+    parser.add_argument("--target-ssim", type=float, default=CONFIG["target_ssim"],
+                        help="Pick the lowest quality per image and format that meets this SSIM (e.g. 0.95)")
+    parser.add_argument("--memory-budget", type=int, default=CONFIG["memory_budget_mb"],
+                        help="RAM budget in MiB for parallel jobs (default: 75%% of available memory)")
+    parser.add_argument("--phase", choices=["all", "preview", "avif"], default="all",
+                        help="Encode everything, only the WebP variants and thumbnails, or only AVIF (resumable)")
+    parser.add_argument("--two-phase", action="store_true",
+                        help="Run the preview phase, then continue with the AVIF phase in the background")
+    parser.add_argument("--wait-for-lock", action="store_true",
+                        help="If another build is using the same manifest, wait for it instead of exiting")
+    parser.add_argument("--catalog", action="store_true",
+                        help="Only encode images referenced by products.ts/products.csv, in catalog order")
+    parser.add_argument("--watch", action="store_true",
+                        help="After the initial build, keep re-encoding images as they change in the input directory")
+    parser.add_argument("--poll", action="store_true", help="With --watch, poll instead of using inotify")
+    parser.add_argument("--debounce", type=float, default=0.5,
+                        help="With --watch, seconds of quiet before a burst of file events is processed")
+    parser.add_argument("--trace", type=str, default=CONFIG["trace_path"], metavar="PATH",
+                        help="Time every stage and write a Chrome trace-event JSON file to PATH")
+    parser.add_argument("--decoded-cache", action="store_true", default=CONFIG["decoded_cache"],
+                        help="Decode each source once into a memory-mapped cache that every worker and later run reuses")
+    parser.add_argument("--dedupe", action="store_true", default=CONFIG["dedupe"],
+                        help="Encode near-identical sources once and record the others as aliases")
+    parser.add_argument("--atlas", action="store_true",
+                        help="Afterwards, pack the catalog thumbnails into sprite atlases (see sprite_atlas.py)")
+    parser.add_argument("--compare-resize", action="store_true",
+                        help="Only report time/memory of the resize planner against direct resizing")
+    args = parser.parse_args(argv)
+    if args.two_phase and args.watch:
+        parser.error("--two-phase can't be combined with --watch: both would write the same outputs")
+
     console.print(Panel.fit("[bold cyan]🖼️  Image Variant Generator[/bold cyan]", border_style="green"))
 
     input_dir = Path(CONFIG["input_dir"])
@@ -94,31 +647,135 @@ def main():
         if p.suffix.lower() in ['.jpg', '.jpeg', '.png']
     ]
 
+    graph = None
+    if args.catalog:
+        graph = build_graph()
+        found = len(image_files)
+        image_files = order_by_catalog(image_files, graph)
+        console.print(f"[cyan]Catalog references {len(image_files)} of {found} source images.[/cyan]")
+        orphans = find_orphans(graph, output_dir)
+        if orphans:
+            console.print(f"[yellow]{len(orphans)} file(s) in '{output_dir}' are not referenced by the catalog; "
+                          f"run `python catalog_graph.py --prune` to remove them.[/yellow]")
+
     if not image_files:
         console.print(f"[yellow]No images found in '{input_dir}'.[/yellow]")
+        if not args.watch:
+            return
+
+    if args.compare_resize:
+        print_resize_comparison(image_files)
         return
 
+    # Without --dedupe every stem is encoded for itself, so aliases from earlier runs are cleared
+    aliases = {}
+    if args.dedupe:
+        image_files, aliases = dedupe_sources(image_files)
+
     # Create output subdirectories
     create_output_dirs(output_dir, ["webp", "avif"])
 
+    CONFIG["jobs"] = args.jobs
+    CONFIG["target_ssim"] = args.target_ssim
+    CONFIG["memory_budget_mb"] = args.memory_budget
+    CONFIG["trace_path"] = args.trace
+    CONFIG["decoded_cache"] = args.decoded_cache
+    if args.decoded_cache:
+        DECODED.enable()
+    if args.trace:
+        TRACER.enable()
+    phase = "preview" if args.two_phase else args.phase
+    if phase == "avif":
+        # AVIF no longer holds up a deploy, so it can afford a slower speed
+        CONFIG["avif_speed"] = CONFIG["avif_phase_speed"]
+    workers, avif_threads = plan_workers(args.jobs)
+
     # Display configuration
     table = Table(title="Script Configuration")
     table.add_column("Setting", style="magenta")
     table.add_column("Value", style="cyan")
     for key, value in CONFIG.items():
         table.add_row(key, str(value))
+    table.add_row("workers × avif threads", f"{workers} × {avif_threads}")
+    table.add_row("phase", phase)
     console.print(table)
 
 
+    # Skip variants whose source and settings haven't changed since the last run.
+    # The AVIF phase saves after every variant, so it resumes where it was stopped.
+    # Only one build may write the outputs and the manifest at a time
+    lock = BuildLock(CONFIG["manifest_path"])
+    try:
+        lock.acquire(wait=args.wait_for_lock)
+    except BuildLocked as e:
+        console.print(f"[bold red]Error: {e}. Wait for it to finish or pass --wait-for-lock.[/bold red]")
+        sys.exit(1)
+    manifest = BuildManifest(CONFIG["manifest_path"], autosave_every=1 if phase == "avif" else None)
+    jobs = phase_jobs(build_jobs(image_files), phase)
+    if not args.force:
+        total = len(jobs)
+        jobs = filter_stale_jobs(jobs, manifest)
+        console.print(f"[cyan]{total - len(jobs)} of {total} variants are up to date.[/cyan]")
+
     # Process images with a progress bar
-    with Progress(console=console) as progress:
-        task = progress.add_task("[green]Processing images...", total=len(image_files))
-        for file_path in image_files:
-            process_image(file_path, progress, task)
+    errors = []
+    placeholders = {}
+    peaks = {}
+    status = None
+    try:
+        with Progress(console=console) as progress:
+            label = "Processing images..." if phase == "all" else f"Processing images ({phase} phase)..."
+            task = progress.add_task(f"[green]{label}", total=len(jobs))
+            if workers > 1:
+                errors = run_parallel(jobs, workers, avif_threads, progress, task, manifest, placeholders, peaks)
+            else:
+                errors = run_serial(jobs, progress, task, manifest, placeholders, peaks)
+    finally:
+        # Save whatever finished, so an interrupted run still resumes incrementally
+        manifest.save()
+        status = build_status(image_files, manifest)
+        update_responsive_manifest(image_files, errors, placeholders, status, aliases)
+
+    if aliases:
+        unused = [p for p in output_dir.rglob("*") if p.is_file() and is_alias_variant(p.stem, aliases)]
+        if unused:
+            size = sum(p.stat().st_size for p in unused)
+            console.print(f"[yellow]{len(unused)} variant file(s) ({size / 1024:.0f} KiB) of aliased duplicates are "
+                          f"no longer used; run `python catalog_graph.py --prune` to remove them.[/yellow]")
+
+    print_peak_memory(peaks)
+    if args.trace:
+        TRACER.export(args.trace)
+        print_trace_summary(TRACER.events)
+        console.print(f"Trace written to '[bold]{args.trace}[/bold]' (open in chrome://tracing or ui.perfetto.dev).")
+
+    if args.atlas:
+        # Imported here so the rest of the pipeline doesn't need numpy
+        from sprite_atlas import MAP_PATH, build_atlases
+        count, rebuilt, missing = build_atlases()
+        console.print(f"[cyan]{count} thumbnail atlas(es), {rebuilt} rebuilt; map at '{MAP_PATH}'.[/cyan]")
+        for stem in missing:
+            console.print(f"[yellow]No thumbnail found for {stem}.[/yellow]")
+
+    if errors:
+        print_errors(errors)
+    else:
+        console.print(f"\n[bold green]✅ Success![/bold green] All images processed.")
+        console.print(f"Find your optimized images in the '[bold]{output_dir}[/bold]' folder.")
+
+    if phase == "preview" and status["servable"]:
+        console.print(f"[bold green]Build is servable;[/bold green] {status['avif_pending']} AVIF variant(s) pending.")
+        if args.two_phase and status["avif_pending"]:
+            # Handed over to the background phase, which waits for it
+            lock.release()
+            process = start_background_phase(args)
+            console.print(f"[cyan]AVIF phase running in the background (pid {process.pid}), "
+                          f"logging to '{CONFIG['avif_phase_log']}'. Re-run with --phase avif to resume it.[/cyan]")
 
-    console.print(f"\n[bold green]✅ Success![/bold green] All images processed.")
-    console.print(f"Find your optimized images in the '[bold]{output_dir}[/bold]' folder.")
+    if args.watch:
+        watch(input_dir, workers, avif_threads, manifest, polling=args.poll, debounce=args.debounce,
+              graph=graph, aliases=aliases)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,143 @@
+# quality_search.py
+
+import io
+import json
+import hashlib
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from build_manifest import atomic_write_json
+
+# Chosen qualities are cached here, one small JSON file per key, so parallel
+# workers can read and write the cache without coordinating.
+DEFAULT_CACHE_DIR = Path(__file__).resolve().parent / ".quality-cache"
+
+# Quality range searched for every format (Pillow's 0-100 scale).
+MIN_QUALITY = 20
+MAX_QUALITY = 95
+
+# SSIM window (pixels) and the usual stabilising constants for 8-bit data.
+SSIM_WINDOW = 7
+_C1 = (0.01 * 255) ** 2
+_C2 = (0.03 * 255) ** 2
+
+
+def _box_mean(x, window):
+    """Mean over every `window`×`window` block, via an integral image."""
+    c = np.pad(x, ((1, 0), (1, 0))).cumsum(0).cumsum(1)
+    s = c[window:, window:] - c[:-window, window:] - c[window:, :-window] + c[:-window, :-window]
+    return s / (window * window)
+
+
+def ssim(a, b, window=SSIM_WINDOW):
+    """Mean structural similarity of two same-size images, on luma."""
+    x = np.asarray(a.convert("L"), dtype=np.float64)
+    y = np.asarray(b.convert("L"), dtype=np.float64)
+    window = max(1, min(window, *x.shape))
+    mx, my = _box_mean(x, window), _box_mean(y, window)
+    vx = _box_mean(x * x, window) - mx * mx
+    vy = _box_mean(y * y, window) - my * my
+    cov = _box_mean(x * y, window) - mx * my
+    s = ((2 * mx * my + _C1) * (2 * cov + _C2)) / ((mx * mx + my * my + _C1) * (vx + vy + _C2))
+    return float(s.mean())
+
+
+def encode_to_bytes(img, fmt, quality, **options):
+    """Encodes `img` in memory with Pillow and returns the bytes."""
+    if fmt == "jpeg" and img.mode in ("RGBA", "LA", "P"):
+        img = img.convert("RGB")
+    buffer = io.BytesIO()
+    img.save(buffer, fmt.upper(), quality=quality, **options)
+    return buffer.getvalue()
+
+
+def lowest_passing(passes, lo, hi, start=None):
+    """
+    Lowest quality in [lo, hi] for which `passes(q)` is true, assuming
+    quality is monotonic. Gallops out from `start` (last run's answer) so an
+    unchanged image costs two encodes, then bisects. Returns `hi` if even
+    that fails.
+    """
+    start = (lo + hi) // 2 if start is None else min(max(start, lo), hi)
+    if passes(start):
+        upper, lower, step = start, start - 1, 1
+        while lower >= lo and passes(lower):
+            upper, step = lower, step * 2
+            lower = upper - step
+        lower = max(lower, lo - 1)
+    else:
+        lower, upper, step = start, start + 1, 1
+        while upper < hi and not passes(upper):
+            lower, step = upper, step * 2
+            upper = lower + step
+        if upper >= hi:
+            upper = hi
+            if lower >= hi or not passes(hi):
+                return hi
+    # lower fails (or is below the range), upper passes
+    while upper - lower > 1:
+        mid = (lower + upper) // 2
+        if passes(mid):
+            upper = mid
+        else:
+            lower = mid
+    return upper
+
+
+class QualityCache:
+    """Chosen qualities keyed by source content and search parameters."""
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR):
+        self.directory = Path(directory)
+
+    def _path(self, key):
+        digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+        return self.directory / digest[:2] / f"{digest}.json"
+
+    def get(self, key):
+        try:
+            return json.loads(self._path(key).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, value):
+        atomic_write_json(self._path(key), value)
+
+
+def search_quality(img, fmt, target, source_hash, name, cache=None, lo=MIN_QUALITY, hi=MAX_QUALITY, **options):
+    """
+    Finds the lowest quality whose encode of `img` still scores at least
+    `target` SSIM against `img` itself.
+
+    The result is cached under the source hash, so unchanged images skip the
+    search; `name` (e.g. the output file name) keys the warm start used when
+    the source changed. Returns (quality, score).
+    """
+    cache = cache or QualityCache()
+    params = {"fmt": fmt, "size": list(img.size), "target": target, "range": [lo, hi],
+              "options": options, "metric": "ssim"}
+    exact_key = dict(params, source=source_hash)
+    warm_key = dict(params, name=name)
+
+    hit = cache.get(exact_key)
+    if hit:
+        return hit["quality"], hit["score"]
+
+    scores = {}
+
+    def passes(q):
+        if q not in scores:
+            data = encode_to_bytes(img, fmt, q, **options)
+            with Image.open(io.BytesIO(data)) as decoded:
+                scores[q] = ssim(img, decoded)
+        return scores[q] >= target
+
+    previous = cache.get(warm_key)
+    quality = lowest_passing(passes, lo, hi, previous["quality"] if previous else None)
+    passes(quality)
+    result = {"quality": quality, "score": scores[quality], "encodes": len(scores)}
+    cache.put(exact_key, result)
+    cache.put(warm_key, result)
+    return quality, scores[quality]
@@ -0,0 +1,171 @@
+# resize_planner.py
+
+import math
+import time
+from pathlib import Path
+from PIL import Image, ImageChops, ImageStat
+
+from decoded_cache import DECODED, standard_mode
+from pipeline_trace import TRACER
+
+# Smallest source/target size ratio a LANCZOS step may start from. Anything
+# coarser than that is done first with JPEG DCT scaling (Image.draft) or an
+# integer box reduce (Image.reduce), and smaller sizes are derived from a
+# larger intermediate once it is at least this much bigger. 2.0 is visually
+# indistinguishable from a direct full-size LANCZOS; raise it for more safety.
+DEFAULT_TOLERANCE = 2.0
+
+
+def target_size(original_size, percent):
+    """Size of a percentage variant, rounded down like the rest of the pipeline."""
+    width, height = original_size
+    return max(1, int(width * (percent / 100))), max(1, int(height * (percent / 100)))
+
+
+def plan_cascade(percentages, tolerance=DEFAULT_TOLERANCE):
+    """
+    Orders the resize steps largest first and picks a source for each one:
+    the smallest already-built size that is still `tolerance` times bigger,
+    or None for the decoded original.
+
+    Returns a list of (percent, source_percent) tuples.
+    """
+    steps = []
+    built = []
+    for percent in sorted(set(percentages), reverse=True):
+        source = next((p for p in sorted(built) if p >= percent * tolerance), None)
+        steps.append((percent, source))
+        built.append(percent)
+    return steps
+
+
+def open_scaled(path, largest_percent, tolerance=DEFAULT_TOLERANCE):
+    """
+    Opens an image and, for JPEGs, asks the decoder for the smallest DCT
+    scale that still covers `tolerance` times the largest requested size.
+
+    With the decoded cache enabled, the full-size pixels are mapped from the
+    cache instead (decoded and stored on the first miss).
+
+    Returns (image, original_size). The image must be closed by the caller.
+    """
+    with TRACER.span("decode", image=Path(path).name, cached=DECODED.enabled):
+        if DECODED.enabled:
+            img = DECODED.open(path)
+            return img, img.size
+        img = Image.open(path)
+        original_size = img.size
+        needed = target_size(original_size, min(100, largest_percent * tolerance))
+        if img.format == "JPEG":
+            img.draft(img.mode, needed)
+        img.load()
+    return img, original_size
+
+
+def resize_cascade(path, percentages, tolerance=DEFAULT_TOLERANCE):
+    """
+    Decodes `path` once and yields (percent, image) for every requested
+    percentage, largest first. Intermediates are dropped as soon as no
+    later step derives from them.
+    """
+    steps = plan_cascade(percentages, tolerance)
+    img, original_size = open_scaled(path, steps[0][0], tolerance)
+    with img:
+        built = {}
+        for i, (percent, source) in enumerate(steps):
+            source_img = img if source is None else built[source]
+            with TRACER.span("resize", image=Path(path).name, percent=percent):
+                resized = source_img.resize(
+                    target_size(original_size, percent),
+                    Image.Resampling.LANCZOS,
+                    reducing_gap=tolerance,
+                )
+            # Cached RGB sources are mapped as RGBX, which the encoders don't take
+            resized = standard_mode(resized)
+            built[percent] = resized
+            yield percent, resized
+
+            still_needed = {s for _, s in steps[i + 1:]}
+            for p in [p for p in built if p not in still_needed]:
+                built.pop(p).close()
+
+
+def resize_one(path, percent, tolerance=DEFAULT_TOLERANCE):
+    """Decodes only as much as needed and returns a single resized copy."""
+    for _, resized in resize_cascade(path, [percent], tolerance):
+        return resized.copy()
+
+
+def _pixel_bytes(img):
+    width, height = img.size
+    return width * height * len(img.getbands())
+
+
+def _psnr(a, b):
+    """Peak signal-to-noise ratio between two same-size images, in dB."""
+    diff = ImageChops.difference(a.convert("RGB"), b.convert("RGB"))
+    mse = sum(ImageStat.Stat(diff).sum2) / (3 * a.size[0] * a.size[1])
+    if mse == 0:
+        return float("inf")
+    return 10 * math.log10(255 ** 2 / mse)
+
+
+def compare_with_direct(path, percentages, tolerance=DEFAULT_TOLERANCE):
+    """
+    Runs the original direct path (full decode, every size resized from the
+    original) and the planned cascade on one image.
+
+    Returns a dict with wall time, estimated peak pixel memory for both paths
+    and the worst PSNR of a planned output against its direct counterpart.
+    `size_peaks` is {percent: (direct, planned)} pixel bytes of a task that
+    builds only that size, as the parallel pipeline does: the direct path
+    always decodes the full image, the planned one only at the JPEG DCT
+    scale that size needs. With the default sizes the largest one needs the
+    full decode, so the saving shows in the smaller sizes.
+    """
+    start = time.perf_counter()
+    direct = {}
+    with Image.open(path) as img:
+        img.load()
+        direct_peak = _pixel_bytes(img)
+        for percent in sorted(set(percentages), reverse=True):
+            direct[percent] = img.resize(target_size(img.size, percent), Image.Resampling.LANCZOS)
+            direct_peak = max(direct_peak, _pixel_bytes(img) + _pixel_bytes(direct[percent]))
+    direct_seconds = time.perf_counter() - start
+
+    full_bytes = _pixel_bytes(img)
+    size_peaks = {}
+    for percent, resized in direct.items():
+        scaled, _ = open_scaled(path, percent, tolerance)
+        with scaled:
+            # Measured on the decoded image, which the draft made smaller than the header says
+            size_peaks[percent] = (full_bytes + _pixel_bytes(resized), _pixel_bytes(scaled) + _pixel_bytes(resized))
+
+    img, _ = open_scaled(path, max(percentages), tolerance)
+    decoded_bytes = _pixel_bytes(img)
+    img.close()
+
+    start = time.perf_counter()
+    planned = {}
+    planned_peak = decoded_bytes
+    steps = plan_cascade(percentages, tolerance)
+    for i, (percent, resized) in enumerate(resize_cascade(path, percentages, tolerance)):
+        planned[percent] = resized.copy()
+        # The cascade also keeps the intermediates later sizes are derived from
+        kept = {source for _, source in steps[i + 1:] if source in planned and source != percent}
+        planned_peak = max(planned_peak, decoded_bytes + _pixel_bytes(resized)
+                           + sum(_pixel_bytes(planned[p]) for p in kept))
+    planned_seconds = time.perf_counter() - start
+
+    worst_psnr = min(_psnr(direct[p], planned[p]) for p in direct)
+    for im in list(direct.values()) + list(planned.values()):
+        im.close()
+
+    return {
+        "direct_seconds": direct_seconds,
+        "planned_seconds": planned_seconds,
+        "direct_peak_bytes": direct_peak,
+        "planned_peak_bytes": planned_peak,
+        "size_peaks": size_peaks,
+        "worst_psnr": worst_psnr,
+    }
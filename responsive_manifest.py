@@ -0,0 +1,145 @@
+# responsive_manifest.py
+
+import os
+import json
+from pathlib import Path
+from PIL import Image
+
+from build_manifest import atomic_write_json
+
+PROJECT_DIR = Path(__file__).resolve().parent
+PUBLIC_DIR = PROJECT_DIR / "public"
+# Served by Vite at /images/manifest.json
+DEFAULT_RESPONSIVE_MANIFEST_PATH = PUBLIC_DIR / "images" / "manifest.json"
+
+MANIFEST_VERSION = 1
+
+FORMATS = {".avif": "avif", ".webp": "webp", ".jpg": "jpeg", ".jpeg": "jpeg", ".png": "png"}
+
+
+def public_url(file_path, public_dir=PUBLIC_DIR):
+    """URL a file under public/ is served from, e.g. /images/webp/bottle_1_75.webp."""
+    return "/" + os.path.relpath(Path(file_path).resolve(), Path(public_dir).resolve()).replace(os.sep, "/")
+
+
+class ResponsiveManifest:
+    """
+    Per-stem list of every generated variant (format, width, height, bytes,
+    URL) for building exact srcset/sizes in the storefront. Only variants that
+    were actually written are listed, and the file is replaced atomically, so
+    an interrupted run leaves the previous manifest intact.
+    """
+
+    def __init__(self, path=DEFAULT_RESPONSIVE_MANIFEST_PATH, public_dir=PUBLIC_DIR):
+        self.path = Path(path)
+        self.public_dir = Path(public_dir)
+        self.images = {}
+        self.aliases = {}
+        self.build = {}
+        self._dirty = False
+        if self.path.exists():
+            try:
+                data = json.loads(self.path.read_text(encoding="utf-8"))
+                if data.get("version") == MANIFEST_VERSION:
+                    self.images = data.get("images", {})
+                    self.aliases = data.get("aliases", {})
+                    self.build = data.get("build", {})
+            except (OSError, ValueError):
+                self.images = {}
+
+    def add(self, stem, file_path, size):
+        """
+        Adds or refreshes one variant from the file on disk. `size` labels it
+        for humans ("75", "thumb", "full"); width and height come from the
+        image header, which is all that is read.
+        """
+        file_path = Path(file_path)
+        if stem in self.aliases or not file_path.exists():
+            return
+        url = public_url(file_path, self.public_dir)
+        byte_size = file_path.stat().st_size
+        variants = self.images.setdefault(stem, {"variants": []})["variants"]
+        current = next((v for v in variants if v["path"] == url), None)
+        if current and current["bytes"] == byte_size:
+            return
+        with Image.open(file_path) as img:
+            width, height = img.size
+        entry = {
+            "path": url,
+            "format": FORMATS.get(file_path.suffix.lower(), file_path.suffix.lower().lstrip(".")),
+            "size": size,
+            "width": width,
+            "height": height,
+            "bytes": byte_size,
+        }
+        if current:
+            variants.remove(current)
+        variants.append(entry)
+        variants.sort(key=lambda v: (v["format"], v["width"]))
+        self._dirty = True
+
+    def refresh(self, file_path):
+        """Updates the byte size of an already listed variant whose file was rewritten."""
+        file_path = Path(file_path)
+        url = public_url(file_path, self.public_dir)
+        byte_size = file_path.stat().st_size
+        for entry in self.images.values():
+            for variant in entry["variants"]:
+                if variant["path"] == url and variant["bytes"] != byte_size:
+                    variant["bytes"] = byte_size
+                    self._dirty = True
+
+    def placeholder(self, stem):
+        """The stem's placeholder (blurhash, inline WebP, colour), or None."""
+        return self.images.get(stem, {}).get("placeholder")
+
+    def set_placeholder(self, stem, placeholder):
+        """Stores a placeholder the storefront can inline while the image loads."""
+        entry = self.images.setdefault(stem, {"variants": []})
+        if entry.get("placeholder") != placeholder:
+            entry["placeholder"] = placeholder
+            self._dirty = True
+
+    def set_aliases(self, aliases):
+        """
+        Replaces the duplicate-image map, {stem: stem whose variants to use}.
+        Aliased stems have no variants of their own: entries listed by earlier
+        runs are dropped.
+        """
+        if aliases != self.aliases:
+            self.aliases = dict(aliases)
+            self._dirty = True
+        for stem in self.aliases:
+            if self.images.pop(stem, None) is not None:
+                self._dirty = True
+
+    def set_build_status(self, **status):
+        """
+        Records how far the build got, e.g. servable=True, complete=False,
+        avif_pending=12, so a deploy can go out before the slow AVIF phase ends.
+        """
+        if any(self.build.get(k) != v for k, v in status.items()):
+            self.build.update(status)
+            self._dirty = True
+
+    def prune(self):
+        """Drops variants whose files no longer exist."""
+        for stem in list(self.images):
+            variants = self.images[stem]["variants"]
+            kept = [v for v in variants if (self.public_dir / v["path"].lstrip("/")).exists()]
+            if len(kept) != len(variants):
+                self._dirty = True
+            if kept:
+                self.images[stem]["variants"] = kept
+            else:
+                del self.images[stem]
+
+    def save(self):
+        """Atomically writes the manifest if anything changed."""
+        self.prune()
+        if not self._dirty:
+            return
+        atomic_write_json(self.path, {
+            "version": MANIFEST_VERSION, "images": self.images, "aliases": self.aliases, "build": self.build,
+        })
+        self._dirty = False
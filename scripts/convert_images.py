@@ -12,11 +12,24 @@ import sys
 SCRIPT_DIR = Path(__file__).resolve().parent
 TARGET_DIR = SCRIPT_DIR.parent / 'public' / 'images'
 
+# Shared helpers (build_manifest.py etc.) live at the project root
+sys.path.insert(0, str(SCRIPT_DIR.parent))
+from build_manifest import BuildLock, BuildLocked, BuildManifest, DEFAULT_MANIFEST_PATH, file_hash  # noqa: E402
+from responsive_manifest import ResponsiveManifest  # noqa: E402
+from catalog_graph import build_graph  # noqa: E402
+from decoded_cache import DECODED, standard_mode  # noqa: E402
+from optimize_images import optimize_directory, print_summary  # noqa: E402
+
 # Conversion quality (0 to 100, 90 is a good balance for web)
 JPEG_QUALITY = 90
 WEBP_QUALITY = 90
 AVIF_QUALITY = 50
 
+# Lossless for the pixels: optimized Huffman tables and progressive scans only
+# change how the same coefficients are stored. No EXIF is written; the
+# source's ICC profile is kept.
+JPEG_SAVE_OPTIONS = {'optimize': True, 'progressive': True}
+
 SUPPORTED_EXT = ['.jpg', '.jpeg', '.png', '.webp', '.avif']
 
 
@@ -29,11 +42,57 @@ def find_image_stems(directory: Path):
     return stems
 
 
-def load_best_image(paths):
-    """Given a list of image Paths for the same stem, pick one to load as source.
+def encoder_settings(ext, target_ssim=None):
+    """Encoder settings recorded in the build manifest for a target extension."""
+    settings = {
+        '.jpg': {'format': 'jpeg', 'quality': JPEG_QUALITY, **JPEG_SAVE_OPTIONS, 'icc_profile': True},
+        '.webp': {'format': 'webp', 'quality': WEBP_QUALITY},
+        '.avif': {'format': 'avif', 'quality': AVIF_QUALITY},
+    }[ext]
+    if target_ssim:
+        # Quality is chosen per image by the search
+        settings = {k: v for k, v in settings.items() if k != 'quality'}
+        settings['target_ssim'] = target_ssim
+    return settings
+
+
+def choose_quality(image, ext, default, src_path, out_path, target_ssim=None):
+    """The fixed quality, or the lowest one that meets target_ssim when a target is given."""
+    if not target_ssim:
+        return default
+    # Imported here so the default mode doesn't need numpy
+    from quality_search import search_quality
+    fmt = {'.jpg': 'jpeg', '.webp': 'webp', '.avif': 'avif'}[ext]
+    quality, score = search_quality(image, fmt, target_ssim, file_hash(src_path), out_path.name)
+    print(f"    Chose quality {quality} for {out_path.name} (SSIM {score:.4f})")
+    return quality
+
+
+def source_icc_profile(src_path):
+    """The source's embedded colour profile (read from the header, so it survives the decoded cache), or None."""
+    with Image.open(src_path) as src:
+        return src.info.get('icc_profile')
+
+
+def source_candidates(paths, manifest=None):
+    """Drop paths we generated ourselves, so a stem's own outputs are never used as its source.
+
+    A recorded output that has since been replaced by hand counts as a source
+    again and is preferred over the rest, since it is the newest original.
+    """
+    if manifest is None:
+        return paths
+    edited = [p for p in paths if manifest.has_any([p]) and not manifest.is_generated(p)]
+    if edited:
+        return edited
+    originals = [p for p in paths if not manifest.is_generated(p)]
+    return originals or paths
+
+
+def load_best_image_path(paths):
+    """Pick the Path to use as source for a stem.
 
     Preference order: avif -> webp -> png -> jpg/jpeg
-    Returns (PIL.Image, source_path)
     """
     # Normalize extension order
     order = ['.avif', '.webp', '.png', '.jpg', '.jpeg']
@@ -50,24 +109,67 @@ def load_best_image(paths):
         # Fallback to first
         pick = paths[0]
 
+    return pick
+
+
+def load_best_image(paths):
+    """Given a list of image Paths for the same stem, pick one to load as source.
+
+    Preference order: avif -> webp -> png -> jpg/jpeg
+    Returns (PIL.Image, source_path)
+    """
+    pick = load_best_image_path(paths)
+    if DECODED.enabled:
+        # Mapped from the decoded cache: an AVIF source is only ever decoded once.
+        # RGB sources come back as RGBX; ensure_variants converts per save where needed
+        return DECODED.open(pick), pick
     img = Image.open(pick)
     return img, pick
 
 
-def ensure_variants(stem: str, paths: list, directory: Path, dry_run=False):
-    """Ensure .jpg, .webp and .avif exist for the given stem. Convert from best source if missing."""
+def ensure_variants(stem: str, paths: list, directory: Path, dry_run=False, manifest=None, target_ssim=None):
+    """Ensure .jpg, .webp and .avif exist for the given stem. Convert from best source if missing.
+
+    With a build manifest, variants are also rebuilt when the source content or
+    the encoder settings changed since they were written.
+    """
     wanted = {
         '.jpg': directory / f'{stem}.jpg',
         '.webp': directory / f'{stem}.webp',
         '.avif': directory / f'{stem}.avif',
     }
 
-    existing = {p.suffix.lower(): p for p in paths}
-
-    # If all present, nothing to do
-    if all(w.exists() for w in wanted.values()):
-        print(f"  All variants exist for: {stem}")
-        return
+    if manifest is None:
+        # If all present, nothing to do
+        if all(w.exists() for w in wanted.values()):
+            print(f"  All variants exist for: {stem}")
+            return
+        stale = {ext for ext, w in wanted.items() if not w.exists()}
+    else:
+        candidates = source_candidates(paths, manifest)
+        src_path = load_best_image_path(candidates)
+        src_hash = manifest.hash(src_path)
+        # The source is never one of its own outputs
+        manifest.forget(src_path)
+        known_stem = manifest.has_any(wanted.values())
+        stale = set()
+        for ext, w in wanted.items():
+            if w == src_path or (ext == '.jpg' and src_path.suffix.lower() == '.jpeg' and w.stem == src_path.stem):
+                continue
+            if manifest.is_fresh(w, src_hash, encoder_settings(ext, target_ssim)):
+                continue
+            if w.exists() and not known_stem:
+                # First time we see this stem: adopt what is already deployed
+                # rather than re-encoding everything once
+                print(f"  Adopting existing {w.name} (built from {src_path.name})")
+                if not dry_run:
+                    manifest.record(w, src_path, src_hash, encoder_settings(ext, target_ssim))
+                continue
+            stale.add(ext)
+        if not stale:
+            print(f"  All variants up to date for: {stem}")
+            return
+        paths = [src_path]
 
     # Load best available source
     try:
@@ -76,50 +178,82 @@ def ensure_variants(stem: str, paths: list, directory: Path, dry_run=False):
         print(f"  Error opening source for {stem}: {e}")
         return
 
-    # Convert alpha images to RGB for formats that don't support alpha
-    def prepare_for_save(image, target_ext):
-        im = image
-        if target_ext == '.jpg' and im.mode in ('RGBA', 'LA', 'P'):
-            im = im.convert('RGB')
-        # WebP and AVIF support alpha; keep as-is
-        return im
-
-    # Ensure JPG
-    jpg_path = wanted['.jpg']
-    if not jpg_path.exists():
-        im_to_save = prepare_for_save(img, '.jpg')
-        print(f"  Creating JPG from {src_path.name} -> {jpg_path.name}")
-        if not dry_run:
-            try:
-                im_to_save.save(jpg_path, 'JPEG', quality=JPEG_QUALITY)
-            except Exception as e:
-                print(f"    Failed to save JPG for {stem}: {e}")
-
-    # Ensure WebP
-    webp_path = wanted['.webp']
-    if not webp_path.exists():
-        im_to_save = prepare_for_save(img, '.webp')
-        print(f"  Creating WebP from {src_path.name} -> {webp_path.name}")
-        if not dry_run:
-            try:
-                im_to_save.save(webp_path, 'WEBP', quality=WEBP_QUALITY)
-            except Exception as e:
-                print(f"    Failed to save WebP for {stem}: {e}")
-
-    # Ensure AVIF
-    avif_path = wanted['.avif']
-    if not avif_path.exists():
-        im_to_save = prepare_for_save(img, '.avif')
-        print(f"  Creating AVIF from {src_path.name} -> {avif_path.name}")
-        if not dry_run:
-            try:
-                # pillow-avif-plugin exposes AVIF support through 'avif' format
-                im_to_save.save(avif_path, 'AVIF', quality=AVIF_QUALITY)
-            except Exception as e:
-                print(f"    Failed to save AVIF for {stem}: {e}")
-
-
-def ensure_all_variants(target_dir: Path, dry_run=False):
+    # Close the source as soon as every variant is written: large originals
+    # would otherwise stay decoded until the garbage collector gets to them
+    try:
+        # Convert alpha images to RGB for formats that don't support alpha
+        def prepare_for_save(image, target_ext):
+            im = image
+            if target_ext == '.jpg' and im.mode in ('RGBA', 'LA', 'P'):
+                im = im.convert('RGB')
+            elif im.mode == 'RGBX' and (target_ext != '.jpg' or target_ssim):
+                # Only the JPEG encoder takes the decoded cache's RGBX as is
+                im = standard_mode(im)
+            # WebP and AVIF support alpha; keep as-is
+            return im
+
+        def release(im_to_save):
+            # Converted copies are full-size too; don't leave them to the garbage collector
+            if im_to_save is not img:
+                im_to_save.close()
+
+        # Ensure JPG
+        jpg_path = wanted['.jpg']
+        if '.jpg' in stale:
+            print(f"  Creating JPG from {src_path.name} -> {jpg_path.name}")
+            if not dry_run:
+                im_to_save = prepare_for_save(img, '.jpg')
+                try:
+                    quality = choose_quality(im_to_save, '.jpg', JPEG_QUALITY, src_path, jpg_path, target_ssim)
+                    options = dict(JPEG_SAVE_OPTIONS)
+                    icc_profile = source_icc_profile(src_path)
+                    if icc_profile:
+                        options['icc_profile'] = icc_profile
+                    im_to_save.save(jpg_path, 'JPEG', quality=quality, **options)
+                    if manifest is not None:
+                        manifest.record(jpg_path, src_path, src_hash, encoder_settings('.jpg', target_ssim))
+                except Exception as e:
+                    print(f"    Failed to save JPG for {stem}: {e}")
+                finally:
+                    release(im_to_save)
+
+        # Ensure WebP
+        webp_path = wanted['.webp']
+        if '.webp' in stale:
+            print(f"  Creating WebP from {src_path.name} -> {webp_path.name}")
+            if not dry_run:
+                im_to_save = prepare_for_save(img, '.webp')
+                try:
+                    quality = choose_quality(im_to_save, '.webp', WEBP_QUALITY, src_path, webp_path, target_ssim)
+                    im_to_save.save(webp_path, 'WEBP', quality=quality)
+                    if manifest is not None:
+                        manifest.record(webp_path, src_path, src_hash, encoder_settings('.webp', target_ssim))
+                except Exception as e:
+                    print(f"    Failed to save WebP for {stem}: {e}")
+                finally:
+                    release(im_to_save)
+
+        # Ensure AVIF
+        avif_path = wanted['.avif']
+        if '.avif' in stale:
+            print(f"  Creating AVIF from {src_path.name} -> {avif_path.name}")
+            if not dry_run:
+                im_to_save = prepare_for_save(img, '.avif')
+                try:
+                    # pillow-avif-plugin exposes AVIF support through 'avif' format
+                    quality = choose_quality(im_to_save, '.avif', AVIF_QUALITY, src_path, avif_path, target_ssim)
+                    im_to_save.save(avif_path, 'AVIF', quality=quality)
+                    if manifest is not None:
+                        manifest.record(avif_path, src_path, src_hash, encoder_settings('.avif', target_ssim))
+                except Exception as e:
+                    print(f"    Failed to save AVIF for {stem}: {e}")
+                finally:
+                    release(im_to_save)
+    finally:
+        img.close()
+
+
+def ensure_all_variants(target_dir: Path, dry_run=False, manifest=None, target_ssim=None, catalog=False):
     print(f"Scanning images in: {target_dir.resolve()}")
     if not target_dir.is_dir():
         print(f"Error: Directory not found at {target_dir.resolve()}")
@@ -130,21 +264,62 @@ def ensure_all_variants(target_dir: Path, dry_run=False):
         print("No supported images found.")
         return
 
-    print(f"Found {len(stems)} image stems to check.")
+    order = sorted(stems)
+    if catalog:
+        # Only stems the storefront references, in catalog order
+        graph = build_graph()
+        order = [stem for stem in graph if stem in stems]
+        print(f"Catalog references {len(order)} of {len(stems)} stems.")
+
+    print(f"Found {len(order)} image stems to check.")
 
-    for stem, paths in sorted(stems.items()):
+    for stem in order:
+        paths = stems[stem]
         print(f"Processing: {stem} (found: {', '.join(p.name for p in paths)})")
-        ensure_variants(stem, paths, target_dir, dry_run=dry_run)
+        ensure_variants(stem, paths, target_dir, dry_run=dry_run, manifest=manifest, target_ssim=target_ssim)
+
+    if manifest is not None and not dry_run:
+        manifest.save()
+
+    if not dry_run:
+        # Keep the storefront's srcset manifest in step with what is on disk
+        responsive = ResponsiveManifest(target_dir / 'manifest.json', public_dir=target_dir.parent)
+        for stem in order:
+            for ext in ('.avif', '.webp', '.jpg'):
+                responsive.add(stem, target_dir / f'{stem}{ext}', 'full')
+        responsive.save()
 
 
 def main(argv=None):
     parser = argparse.ArgumentParser(description='Ensure jpg, webp and avif variants for images in public/images')
     parser.add_argument('--target', '-t', type=str, default=str(TARGET_DIR), help='Target images directory')
     parser.add_argument('--dry-run', action='store_true', help='Do not write files; just print actions')
+    parser.add_argument('--manifest', type=str, default=str(DEFAULT_MANIFEST_PATH), help='Build manifest used to detect changed sources and settings')
+    parser.add_argument('--no-manifest', action='store_true', help='Only create missing variants (previous behaviour)')
+    parser.add_argument('--catalog', action='store_true', help='Only process stems referenced by products.ts/products.csv, in catalog order')
+    parser.add_argument('--target-ssim', type=float, default=None, help='Pick the lowest quality per image and format that meets this SSIM (e.g. 0.95)')
+    parser.add_argument('--decoded-cache', action='store_true', help='Reuse decoded sources from the memory-mapped cache shared with python_only.py')
+    parser.add_argument('--optimize', action='store_true', help='Afterwards, losslessly re-optimize every JPEG/WebP in the target directory (see optimize_images.py)')
     args = parser.parse_args(argv)
 
+    if args.decoded_cache and not args.dry_run:
+        DECODED.enable()
+
     td = Path(args.target)
-    ensure_all_variants(td, dry_run=args.dry_run)
+    manifest = None if args.no_manifest else BuildManifest(args.manifest)
+    if manifest is not None and not args.dry_run:
+        # python_only.py writes the same manifest; never save over a running build
+        lock = BuildLock(args.manifest)  # held until the script exits
+        try:
+            lock.acquire()
+        except BuildLocked as e:
+            print(f"Error: {e} on {args.manifest}.")
+            sys.exit(1)
+    ensure_all_variants(td, dry_run=args.dry_run, manifest=manifest, target_ssim=args.target_ssim, catalog=args.catalog)
+
+    if args.optimize and td.is_dir():
+        print("Re-optimizing JPEG/WebP files (progressive, optimized Huffman, ICC kept)...")
+        print_summary(optimize_directory(td, manifest, dry_run=args.dry_run), td, args.dry_run)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,182 @@
+# sprite_atlas.py
+
+import json
+import argparse
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from build_manifest import atomic_output, atomic_write_json, file_hash
+from catalog_graph import IMAGES_DIR, PRODUCTS_TS, thumbnails_from_ts
+from encoders import PillowBackend, VariantSpec
+from responsive_manifest import public_url
+
+# --- Configuration ---
+ATLAS_DIR = IMAGES_DIR / "atlas"
+MAP_PATH = ATLAS_DIR / "thumbs.json"
+
+# ProductCard renders every image into a 2:3 box with object-cover, so each
+# thumbnail is cropped the same way into a fixed cell. 2x the card's CSS size.
+CELL_WIDTH = 240
+CELL_HEIGHT = 360
+
+# Thumbnails per atlas; the first atlas holds the first cards on the Home grid.
+PER_ATLAS = 24
+
+WEBP_QUALITY = 75
+AVIF_QUALITY = 55
+# --- End of Configuration ---
+
+MAP_VERSION = 1
+
+# Where a stem's thumbnail is looked for, best first: python_only.py's
+# thumbnail, then the full-size files next to it.
+_CANDIDATES = ("webp/{stem}_thumb.webp", "{stem}.webp", "{stem}.jpg", "{stem}.png", "{stem}.avif")
+
+
+def member_source(stem, images_dir=IMAGES_DIR):
+    for pattern in _CANDIDATES:
+        path = Path(images_dir) / pattern.format(stem=stem)
+        if path.is_file():
+            return path
+    return None
+
+
+def load_cell(path, cell=(CELL_WIDTH, CELL_HEIGHT)):
+    """A member as an (h, w, 3) uint8 array, cropped like object-cover and flattened onto white."""
+    with Image.open(path) as img:
+        if img.format == "JPEG":
+            img.draft("RGB", cell)
+        img = img.convert("RGBA")
+        fitted = ImageOps.fit(img, cell, Image.Resampling.LANCZOS)
+    background = Image.new("RGBA", cell, (255, 255, 255, 255))
+    background.alpha_composite(fitted)
+    return np.asarray(background.convert("RGB"))
+
+
+def composite(cells, columns):
+    """Tiles (n, h, w, c) cells into one grid image in a single reshape; blank cells are white."""
+    n, h, w, c = cells.shape
+    rows = -(-n // columns)
+    padded = np.full((rows * columns, h, w, c), 255, dtype=np.uint8)
+    padded[:n] = cells
+    return padded.reshape(rows, columns, h, w, c).transpose(0, 2, 1, 3, 4).reshape(rows * h, columns * w, c)
+
+
+def grid_columns(count):
+    """Near-square grid, so neither atlas dimension hits encoder limits first."""
+    return max(1, round(count ** 0.5 * (CELL_HEIGHT / CELL_WIDTH) ** 0.5))
+
+
+def css_position(index, count, columns):
+    """background-size/-position percentages that show cell `index` in a box of any size."""
+    rows = -(-count // columns)
+    col, row = index % columns, index // columns
+    x = 0 if columns == 1 else col * 100 / (columns - 1)
+    y = 0 if rows == 1 else row * 100 / (rows - 1)
+    return {
+        "backgroundSize": f"{columns * 100}% {rows * 100}%",
+        "backgroundPosition": f"{x:g}% {y:g}%",
+    }
+
+
+def load_map(path=MAP_PATH):
+    try:
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        return data if data.get("version") == MAP_VERSION else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def build_atlases(thumbs=None, images_dir=IMAGES_DIR, atlas_dir=ATLAS_DIR, map_path=MAP_PATH, force=False):
+    """
+    Packs the catalog thumbnails into atlases of PER_ATLAS cells and writes
+    the coordinate map. An atlas is re-encoded only when one of its members'
+    files, the member list or the settings changed.
+
+    Returns (number of atlases, number rebuilt, stems without an image).
+    """
+    thumbs = thumbnails_from_ts(PRODUCTS_TS) if thumbs is None else thumbs
+    sources = {}
+    missing = []
+    for product, stem in thumbs.items():
+        if stem in sources or stem in missing:
+            continue
+        path = member_source(stem, images_dir)
+        if path is None:
+            missing.append(stem)
+        else:
+            sources[stem] = path
+
+    stems = list(sources)
+    settings = {"cell": [CELL_WIDTH, CELL_HEIGHT], "webp_quality": WEBP_QUALITY, "avif_quality": AVIF_QUALITY}
+    previous = load_map(map_path)
+    old_atlases = previous.get("atlases", []) if previous.get("settings") == settings else []
+    atlas_dir = Path(atlas_dir)
+    atlas_dir.mkdir(parents=True, exist_ok=True)
+
+    atlases = []
+    members = {}
+    rebuilt = 0
+    for index, start in enumerate(range(0, len(stems), PER_ATLAS)):
+        group = stems[start:start + PER_ATLAS]
+        # A list, not a dict: member order decides every cell's position
+        inputs = [[stem, file_hash(sources[stem])] for stem in group]
+        columns = grid_columns(len(group))
+        outputs = {fmt: atlas_dir / f"thumbs_{index}.{fmt}" for fmt in ("webp", "avif")}
+        old = old_atlases[index] if index < len(old_atlases) else None
+        fresh = (not force and old is not None and old.get("inputs") == inputs
+                 and all(path.exists() for path in outputs.values()))
+        if not fresh:
+            cells = np.stack([load_cell(sources[stem]) for stem in group])
+            atlas = Image.fromarray(composite(cells, columns))
+            for fmt, path in outputs.items():
+                quality = AVIF_QUALITY if fmt == "avif" else WEBP_QUALITY
+                with atomic_output(path) as tmp_path:
+                    PillowBackend().save(atlas, tmp_path, VariantSpec(fmt, *atlas.size, quality))
+            rebuilt += 1
+        rows = -(-len(group) // columns)
+        atlases.append({
+            "webp": public_url(outputs["webp"]),
+            "avif": public_url(outputs["avif"]),
+            "width": columns * CELL_WIDTH,
+            "height": rows * CELL_HEIGHT,
+            "inputs": inputs,
+        })
+        for i, stem in enumerate(group):
+            col, row = i % columns, i // columns
+            members[stem] = {
+                "atlas": index,
+                "x": col * CELL_WIDTH, "y": row * CELL_HEIGHT, "w": CELL_WIDTH, "h": CELL_HEIGHT,
+                **css_position(i, len(group), columns),
+            }
+
+    # Atlases left over from a larger catalog
+    for path in atlas_dir.glob("thumbs_*.*"):
+        if path.stem.split("_")[-1].isdigit() and int(path.stem.split("_")[-1]) >= len(atlases):
+            path.unlink()
+
+    atomic_write_json(map_path, {
+        "version": MAP_VERSION,
+        "settings": settings,
+        "atlases": atlases,
+        "members": members,
+        "products": {product: stem for product, stem in thumbs.items() if stem in members},
+    })
+    return len(atlases), rebuilt, missing
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pack the catalog thumbnails into sprite atlases")
+    parser.add_argument("--force", action="store_true", help="Re-encode every atlas")
+    args = parser.parse_args(argv)
+
+    count, rebuilt, missing = build_atlases(force=args.force)
+    print(f"{count} atlas(es), {rebuilt} rebuilt; map written to {MAP_PATH}")
+    for stem in missing:
+        print(f"  No image found for {stem}")
+
+
+if __name__ == "__main__":
+    main()
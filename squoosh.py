@@ -1,8 +1,11 @@
 # image_optimizer.py
 
 import os
-import subprocess
+import sys
 import json
+import shutil
+import signal
+import asyncio
 from PIL import Image
 
 # --- Configuration ---
@@ -20,6 +23,18 @@ RESIZE_PERCENTAGE = 50
 # Valid image file extensions to look for.
 VALID_EXTENSIONS = ('.png', '.jpg', '.jpeg')
 
+# How many Squoosh CLI processes to run at once.
+CONCURRENCY = os.cpu_count() or 2
+
+# Seconds before a single encode is considered hung and killed.
+JOB_TIMEOUT = 300
+
+# How many times a failed or timed-out image is retried.
+MAX_RETRIES = 1
+
+# Print each encoder's stderr as it arrives (prefixed with the file name).
+STREAM_STDERR = True
+
 # --- End of Configuration ---
 
 
@@ -41,10 +56,119 @@ def get_new_dimensions(image_path, percentage):
         print(f"❌ Could not read image dimensions from {image_path}: {e}")
         return None, None
 
+def build_command(input_path, new_width, new_height):
+    """Builds the Squoosh CLI command that resizes one image and writes WebP and AVIF."""
+    resize_config = {
+        "enabled": True,
+        "width": new_width,
+        "height": new_height,
+        "method": "lanczos3",
+        "fitMethod": "stretch",
+        "premultiply": True,
+        "linearRGB": True,
+    }
+    return [
+        "npx", "@squoosh/cli",
+        "--resize", json.dumps(resize_config),
+        "--webp", "auto",  # Generate WebP with auto quality
+        "--avif", "auto",  # Generate AVIF with auto quality
+        "-d", OUTPUT_DIR,  # Set the output directory
+        input_path
+    ]
+
+def kill_process_group(proc):
+    """Kills the encoder and its children (npx starts node as a child)."""
+    try:
+        if os.name == "posix":
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except ProcessLookupError:
+        pass
+
+async def stream_stderr(proc, filename, tail):
+    """Prints the encoder's stderr line by line and keeps the last lines for the error summary."""
+    while True:
+        line = await proc.stderr.readline()
+        if not line:
+            break
+        # The CLI redraws its progress with carriage returns
+        for part in line.decode(errors="replace").replace("\r", "\n").splitlines():
+            part = part.strip()
+            if part:
+                tail.append(part)
+                del tail[:-20]
+                if STREAM_STDERR:
+                    print(f"  [{filename}] {part}")
+
+async def run_once(command, filename, timeout):
+    """Runs one command; returns (ok, reason, stderr tail)."""
+    proc = await asyncio.create_subprocess_exec(
+        *command,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=(os.name == "posix"),
+    )
+    tail = []
+    reader = asyncio.create_task(stream_stderr(proc, filename, tail))
+    try:
+        await asyncio.wait_for(proc.wait(), timeout)
+    except asyncio.TimeoutError:
+        kill_process_group(proc)
+        await proc.wait()
+        reader.cancel()
+        return False, f"timed out after {timeout}s", tail
+    except asyncio.CancelledError:
+        kill_process_group(proc)
+        raise
+    await reader
+    if proc.returncode != 0:
+        return False, f"exit code {proc.returncode}", tail
+    return True, None, tail
+
+async def process_one(filename, semaphore):
+    """Resizes and encodes one image, retrying on failure; returns None or an error dict."""
+    input_path = os.path.join(INPUT_DIR, filename)
+
+    # 1. Calculate new dimensions for resizing
+    new_width, new_height = get_new_dimensions(input_path, RESIZE_PERCENTAGE)
+    if new_width is None:
+        return {"file": filename, "reason": "could not read image dimensions", "stderr": []}
+
+    # 2. Build the full Squoosh CLI command
+    command = build_command(input_path, new_width, new_height)
+
+    # 3. Execute it, waiting for a free slot
+    async with semaphore:
+        for attempt in range(1, MAX_RETRIES + 2):
+            print(f"Running Squoosh CLI for {filename} (attempt {attempt})... 🚀")
+            ok, reason, tail = await run_once(command, filename, JOB_TIMEOUT)
+            if ok:
+                print(f"✅ Successfully processed {filename}.")
+                return None
+            print(f"⚠️ {filename}: {reason}")
+    return {"file": filename, "reason": reason, "stderr": tail}
+
+async def process_all(image_files, concurrency):
+    """Runs every image with at most `concurrency` encoders at once; returns the errors."""
+    semaphore = asyncio.Semaphore(concurrency)
+    results = await asyncio.gather(*(process_one(f, semaphore) for f in image_files))
+    return [r for r in results if r]
+
+def print_error_summary(errors):
+    """Lists every image that still failed after its retries."""
+    print(f"\n❌ {len(errors)} image(s) failed:")
+    for error in errors:
+        print(f"\n- {error['file']}: {error['reason']}")
+        for line in error["stderr"][-5:]:
+            print(f"    {line}")
+
 def process_images():
     """
     Finds images in the input directory and processes them using the Squoosh CLI
-    to resize and generate WebP and AVIF versions.
+    to resize and generate WebP and AVIF versions. Up to CONCURRENCY images are
+    encoded at once; a hung encoder is killed after JOB_TIMEOUT and retried, and
+    one failing image doesn't stop the others. Returns the list of failures.
     """
     print("--- Starting Image Processing Script --- ✨")
     create_directory_if_not_exists(OUTPUT_DIR)
@@ -54,60 +178,26 @@ def process_images():
     except FileNotFoundError:
         print(f"❌ Error: Input directory '{INPUT_DIR}' not found.")
         print("Please create it and add your images before running the script.")
-        return
+        return []
 
     if not image_files:
         print(f"🤷 No images with extensions {VALID_EXTENSIONS} found in '{INPUT_DIR}'.")
-        return
-
-    print(f"Found {len(image_files)} images to process.")
-
-    for filename in image_files:
-        input_path = os.path.join(INPUT_DIR, filename)
-        print(f"\nProcessing: {filename}...")
-
-        # 1. Calculate new dimensions for resizing
-        new_width, new_height = get_new_dimensions(input_path, RESIZE_PERCENTAGE)
-        if new_width is None:
-            continue
-
-        # 2. Construct the resize configuration JSON for Squoosh CLI
-        resize_config = {
-            "enabled": True,
-            "width": new_width,
-            "height": new_height,
-            "method": "lanczos3",
-            "fitMethod": "stretch",
-            "premultiply": True,
-            "linearRGB": True,
-        }
-        resize_json_string = json.dumps(resize_config)
-
-        # 3. Build the full Squoosh CLI command
-        command = [
-            "npx", "@squoosh/cli",
-            "--resize", resize_json_string,
-            "--webp", "auto",  # Generate WebP with auto quality
-            "--avif", "auto",  # Generate AVIF with auto quality
-            "-d", OUTPUT_DIR,  # Set the output directory
-            input_path
-        ]
-
-        # 4. Execute the command
-        try:
-            print("Running Squoosh CLI... 🚀")
-            subprocess.run(command, check=True, capture_output=True, text=True)
-            print(" ".join(command))
-            print(f"✅ Successfully processed {filename}.")
-        except subprocess.CalledProcessError as e:
-            print(f"❌ An error occurred while processing {filename}:")
-            print(f"Error Output:\n{e.stderr}")
-        except FileNotFoundError:
-            print("❌ Error: 'npx' command not found.")
-            print("Please ensure Node.js and npm are installed and in your system's PATH.")
-            break
+        return []
+
+    if shutil.which("npx") is None:
+        print("❌ Error: 'npx' command not found.")
+        print("Please ensure Node.js and npm are installed and in your system's PATH.")
+        return [{"file": f, "reason": "npx not found", "stderr": []} for f in image_files]
+
+    concurrency = max(1, min(CONCURRENCY, len(image_files)))
+    print(f"Found {len(image_files)} images to process ({concurrency} at a time).")
+
+    errors = asyncio.run(process_all(image_files, concurrency))
 
+    if errors:
+        print_error_summary(errors)
     print("\n--- All Done! --- 🎉")
+    return errors
 
 if __name__ == "__main__":
     # Create the input directory if it doesn't exist to guide the user
@@ -116,4 +206,4 @@ if __name__ == "__main__":
         os.makedirs(INPUT_DIR)
         print(f"Please place your images in the '{INPUT_DIR}' folder and run the script again.")
     else:
-        process_images()
\ No newline at end of file
+        sys.exit(1 if process_images() else 0)
\ No newline at end of file
@@ -1,10 +1,13 @@
 # image_processor_v2.py
 
 import os
+import time
 import subprocess
 import json
 from PIL import Image
 
+from pipeline_trace import TRACER, summarize
+
 # Import the rich library for beautiful CLI output
 from rich.console import Console
 from rich.progress import Progress, BarColumn, TextColumn, TimeRemainingColumn
@@ -15,6 +18,19 @@ INPUT_DIR = "./images_original/chosen"
 OUTPUT_DIR = "./public/images"
 VALID_EXTENSIONS = ('.png', '.jpg', '.jpeg')
 
+# --- Batching ---
+# Each squoosh-cli run pays for npx resolution, Node startup and WASM codec
+# instantiation. With batching on, images that resize to identical dimensions
+# are passed to a single invocation instead of one invocation per image.
+BATCH_MODE = True
+# Max files per invocation, to stay well under OS command-line length limits.
+MAX_BATCH_SIZE = 50
+
+# --- Profiling ---
+# Set to a file path (e.g. "./squoosh-trace.json") to time every squoosh-cli
+# run, plus one bare npx/CLI startup, and write a Chrome trace-event file.
+TRACE_PATH = None
+
 # --- Full-Size Image Settings ---
 # Percentage to resize full-size images to (e.g., 50 means 50% of original size).
 RESIZE_PERCENTAGE = 50
@@ -60,22 +76,25 @@ def get_image_dimensions(image_path):
         console.print(f"❌ [bold red]Error reading {os.path.basename(image_path)}:[/bold red] {e}")
         return None, None
 
+def scaled_size(width, height, percentage):
+    """Returns the (width, height) an image is resized to."""
+    return int(width * (percentage / 100)), int(height * (percentage / 100))
+
 def create_resize_json(width, height, percentage):
     """Creates the JSON string for Squoosh's resize option."""
-    new_width = int(width * (percentage / 100))
-    new_height = int(height * (percentage / 100))
+    new_width, new_height = scaled_size(width, height, percentage)
     resize_config = {
         "enabled": True, "width": new_width, "height": new_height,
         "method": "lanczos3", "fitMethod": "stretch", "premultiply": True, "linearRGB": True
     }
     return json.dumps(resize_config)
 
-def run_squoosh_command(command, filename):
-    """Executes a Squoosh CLI command and handles errors."""
+def run_squoosh_command(command, filename, batch=False):
+    """Executes a Squoosh CLI command and handles errors. A batch's span is not attributed to any one image."""
+    span_args = {"batch": filename} if batch else {"image": filename}
     try:
-        a=subprocess.run(command, check=True, capture_output=True, text=True)
-        print("".join(command))
-        exit()
+        with TRACER.span("squoosh-cli", args=len(command), **span_args):
+            subprocess.run(command, check=True, capture_output=True, text=True)
         return True
     except subprocess.CalledProcessError as e:
         console.print(f"❌ [bold red]Squoosh error on {filename}:[/bold red]")
@@ -86,6 +105,130 @@ def run_squoosh_command(command, filename):
         console.print("Please ensure Node.js and npm are installed and in your system's PATH.")
         return False
 
+def build_full_command(resize_json, input_paths):
+    """Command for the full-size WebP + AVIF encode of one or more images."""
+    return [
+        "npx", "@frostoven/squoosh-cli",
+        "--resize", resize_json,
+        "--webp", json.dumps(WEBP_CONFIG),
+        "--avif", json.dumps(AVIF_CONFIG),
+        "-d", OUTPUT_DIR,
+        *input_paths
+    ]
+
+def build_thumb_command(resize_json, input_paths):
+    """Command for the WebP thumbnail encode of one or more images."""
+    return [
+        "npx", "@frostoven/squoosh-cli",
+        "--resize", resize_json,
+        "--webp", json.dumps(WEBP_CONFIG),
+        "--suffix", THUMB_SUFFIX,
+        "-d", OUTPUT_DIR,
+        *input_paths
+    ]
+
+def squoosh_outputs(filename, thumb=False):
+    """Files squoosh-cli writes for one input: its WebP and AVIF, or its WebP thumbnail."""
+    stem = os.path.splitext(filename)[0]
+    if thumb:
+        return [os.path.join(OUTPUT_DIR, f"{stem}{THUMB_SUFFIX}.webp")]
+    return [os.path.join(OUTPUT_DIR, f"{stem}.{ext}") for ext in ("webp", "avif")]
+
+def written_since(paths, since_ns):
+    """Wall-clock time (ns) the last of `paths` was written, or None unless all were written after `since_ns`."""
+    try:
+        mtimes = [os.stat(p).st_mtime_ns for p in paths]
+    except OSError:
+        return None
+    return max(mtimes) if min(mtimes) >= since_ns else None
+
+def run_batch(build_command, filenames, label, suffix="", thumb=False):
+    """
+    Runs one squoosh-cli invocation for `filenames` and returns those that
+    failed. A failed batch only fails the files whose outputs are missing,
+    and those are retried one at a time, so one bad file doesn't take the
+    rest down with it. With tracing on, every image gets its own span, from
+    the start of the run to the last write of its outputs.
+    """
+    if len(filenames) == 1:
+        return [] if run_squoosh_command(build_command([os.path.join(INPUT_DIR, filenames[0])]), label) else filenames
+
+    start_wall, start_ns = time.time_ns(), time.perf_counter_ns()
+    ok = run_squoosh_command(build_command([os.path.join(INPUT_DIR, f) for f in filenames]), label, batch=True)
+    # File mtimes come from a coarse kernel clock, up to a tick behind time.time_ns()
+    written = {f: written_since(squoosh_outputs(f, thumb), start_wall - 20_000_000) for f in filenames}
+    for f, done_wall in written.items():
+        if done_wall is not None:
+            TRACER.record("squoosh-cli image", start_ns, start_ns + done_wall - start_wall, image=f"{f}{suffix}", batch=label)
+    if ok:
+        return []
+
+    missing = [f for f, done_wall in written.items() if done_wall is None]
+    console.print(f"Retrying [bold]{len(missing)}[/bold] of {len(filenames)} images from {label} one at a time.")
+    return [f for f in missing
+            if not run_squoosh_command(build_command([os.path.join(INPUT_DIR, f)]), f"{f}{suffix}")]
+
+def group_by_dimensions(image_files):
+    """
+    Groups images with identical original dimensions, so each group shares
+    one resize setting and can go through a single squoosh-cli invocation.
+    Returns a list of ((width, height), [filenames]) in input order, with
+    groups split at MAX_BATCH_SIZE. Unreadable images are returned separately.
+    """
+    groups = {}
+    unreadable = []
+    for filename in image_files:
+        width, height = get_image_dimensions(os.path.join(INPUT_DIR, filename))
+        if not width:
+            unreadable.append(filename)
+            continue
+        groups.setdefault((width, height), []).append(filename)
+
+    batches = []
+    for size, filenames in groups.items():
+        for i in range(0, len(filenames), MAX_BATCH_SIZE):
+            batches.append((size, filenames[i:i + MAX_BATCH_SIZE]))
+    return batches, unreadable
+
+def process_batches(image_files, progress, task):
+    """Encodes images in as few squoosh-cli invocations as their dimensions allow."""
+    batches, unreadable = group_by_dimensions(image_files)
+    progress.advance(task, len(unreadable))
+    console.print(f"Batched [bold cyan]{len(image_files) - len(unreadable)}[/bold cyan] images into [bold cyan]{len(batches)}[/bold cyan] squoosh-cli runs per pass.")
+
+    for (width, height), filenames in batches:
+        label = filenames[0] if len(filenames) == 1 else f"{len(filenames)} images {width}×{height}"
+        progress.update(task, description=f"Processing [bold]{label}[/bold]")
+
+        # --- 1. Process Full-Size Images (WebP + AVIF) ---
+        resize_json_full = create_resize_json(width, height, RESIZE_PERCENTAGE)
+        failed = run_batch(lambda paths: build_full_command(resize_json_full, paths), filenames, label)
+        encoded = [f for f in filenames if f not in failed] # Failed files get no thumbnail
+
+        # --- 2. Process Thumbnail Images (WebP only) ---
+        if GENERATE_THUMBS and encoded:
+            resize_json_thumb = create_resize_json(width, height, THUMB_RESIZE_PERCENTAGE)
+            thumb_label = encoded[0] if len(encoded) == 1 else f"{len(encoded)} images {width}×{height}"
+            run_batch(lambda paths: build_thumb_command(resize_json_thumb, paths), encoded,
+                      f"{thumb_label} (thumb)", suffix=" (thumb)", thumb=True)
+
+        progress.advance(task, len(filenames))
+
+def measure_npx_startup():
+    """Times one bare CLI start, i.e. the fixed cost every squoosh-cli run pays before encoding."""
+    with TRACER.span("npx startup"):
+        subprocess.run(["npx", "@frostoven/squoosh-cli", "--help"], capture_output=True, text=True)
+
+def report_trace():
+    """Writes the trace file and prints where the time went."""
+    TRACER.export(TRACE_PATH)
+    stages, images = summarize(TRACER.events)
+    for name, stage in sorted(stages.items(), key=lambda item: item[1]["total_ms"], reverse=True):
+        console.print(f"  {name}: {stage['count']}× {stage['total_ms'] / 1000:.2f}s total, {stage['max_ms']:.0f}ms max")
+    for name, ms in sorted(images.items(), key=lambda item: item[1], reverse=True)[:10]:
+        console.print(f"  {name}: {ms / 1000:.2f}s")
+    console.print(f"Trace written to '{TRACE_PATH}'.")
+
 def process_images():
     """Finds and processes all images using Squoosh and Rich for progress."""
     if not os.path.exists(INPUT_DIR) or not os.listdir(INPUT_DIR):
@@ -101,6 +244,10 @@ def process_images():
 
     console.print(Panel(f"Found [bold cyan]{len(image_files)}[/bold cyan] images. Starting processing...", title="[bold]Image Optimizer[/bold]", border_style="green"))
 
+    if TRACE_PATH:
+        TRACER.enable()
+        measure_npx_startup()
+
     with Progress(
         TextColumn("[bold cyan]{task.description}", justify="right"),
         BarColumn(bar_width=None),
@@ -110,44 +257,36 @@ def process_images():
     ) as progress:
         task = progress.add_task("[green]Processing...", total=len(image_files))
 
-        for filename in image_files:
-            progress.update(task, description=f"Processing [bold]{filename}[/bold]")
-            input_path = os.path.join(INPUT_DIR, filename)
-            original_width, original_height = get_image_dimensions(input_path)
-            if not original_width:
-                progress.advance(task)
-                continue
-
-            # --- 1. Process Full-Size Images (WebP + AVIF) ---
-            resize_json_full = create_resize_json(original_width, original_height, RESIZE_PERCENTAGE)
-            command_full = [
-                "npx", "@frostoven/squoosh-cli",
-                "--resize", resize_json_full,
-                "--webp", json.dumps(WEBP_CONFIG),
-                "--avif", json.dumps(AVIF_CONFIG),
-                "-d", OUTPUT_DIR,
-                input_path
-            ]
-            if not run_squoosh_command(command_full, filename):
+        if BATCH_MODE:
+            process_batches(image_files, progress, task)
+        else:
+            for filename in image_files:
+                progress.update(task, description=f"Processing [bold]{filename}[/bold]")
+                input_path = os.path.join(INPUT_DIR, filename)
+                original_width, original_height = get_image_dimensions(input_path)
+                if not original_width:
+                    progress.advance(task)
+                    continue
+
+                # --- 1. Process Full-Size Images (WebP + AVIF) ---
+                resize_json_full = create_resize_json(original_width, original_height, RESIZE_PERCENTAGE)
+                command_full = build_full_command(resize_json_full, [input_path])
+                if not run_squoosh_command(command_full, filename):
+                    progress.advance(task)
+                    continue # Skip to next file on error
+
+                # --- 2. Process Thumbnail Image (WebP only) ---
+                if GENERATE_THUMBS:
+                    resize_json_thumb = create_resize_json(original_width, original_height, THUMB_RESIZE_PERCENTAGE)
+                    command_thumb = build_thumb_command(resize_json_thumb, [input_path])
+                    run_squoosh_command(command_thumb, f"{filename} (thumb)")
+
                 progress.advance(task)
-                continue # Skip to next file on error
-
-            # --- 2. Process Thumbnail Image (WebP only) ---
-            if GENERATE_THUMBS:
-                resize_json_thumb = create_resize_json(original_width, original_height, THUMB_RESIZE_PERCENTAGE)
-                command_thumb = [
-                    "npx", "@frostoven/squoosh-cli",
-                    "--resize", resize_json_thumb,
-                    "--webp", json.dumps(WEBP_CONFIG),
-                    "--suffix", THUMB_SUFFIX,
-                    "-d", OUTPUT_DIR,
-                    input_path
-                ]
-                run_squoosh_command(command_thumb, f"{filename} (thumb)")
-
-            progress.advance(task)
 
     console.print(Panel("🎉 [bold green]All images processed successfully![/bold green]", title="[bold]Complete[/bold]", border_style="green"))
 
+    if TRACE_PATH:
+        report_trace()
+
 if __name__ == "__main__":
     process_images()
\ No newline at end of file
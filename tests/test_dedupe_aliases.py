@@ -0,0 +1,59 @@
+# tests/test_dedupe_aliases.py
+
+import sys
+import random
+from pathlib import Path
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+pytest.importorskip("rich")
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import python_only  # noqa: E402
+from catalog_graph import find_orphans, load_aliases  # noqa: E402
+from responsive_manifest import ResponsiveManifest  # noqa: E402
+
+
+def make_sources(input_dir):
+    """bottle.jpg and a re-encoded copy of it, which --dedupe aliases."""
+    rng = random.Random(0)
+    img = Image.new("RGB", (320, 480))
+    for x in range(0, 320, 40):
+        for y in range(0, 480, 40):
+            img.paste(tuple(rng.randrange(256) for _ in range(3)), (x, y, x + 40, y + 40))
+    img.save(input_dir / "bottle.jpg", quality=95)
+    img.save(input_dir / "bottle_copy.jpg", quality=80)
+
+
+def test_plain_run_after_dedupe_clears_aliases_and_prune_keeps_variants(tmp_path, monkeypatch):
+    input_dir, output_dir = tmp_path / "chosen", tmp_path / "images"
+    input_dir.mkdir()
+    output_dir.mkdir()
+    make_sources(input_dir)
+    responsive_path = output_dir / "manifest.json"
+    for key, value in {
+        "input_dir": str(input_dir),
+        "output_dir": str(output_dir),
+        "manifest_path": str(tmp_path / "build-manifest.json"),
+        "responsive_manifest_path": str(responsive_path),
+        "routing_path": str(tmp_path / "routing.json"),
+        "placeholders": False,
+    }.items():
+        monkeypatch.setitem(python_only.CONFIG, key, value)
+
+    python_only.main(["--dedupe", "--jobs", "1"])
+    assert load_aliases(responsive_path) == {"bottle_copy": "bottle"}
+
+    python_only.main(["--jobs", "1"])
+    assert load_aliases(responsive_path) == {}
+    assert "bottle_copy" in ResponsiveManifest(responsive_path, public_dir=tmp_path).images
+    built = {p for p in output_dir.rglob("*") if p.is_file() and p.name != "manifest.json"}
+    assert any(p.stem.startswith("bottle_copy_") for p in built)
+
+    # catalog_graph.py --prune
+    graph = {"bottle": ["p1"], "bottle_copy": ["p2"]}
+    for path in find_orphans(graph, output_dir, aliases=load_aliases(responsive_path)):
+        path.unlink()
+    assert built == {p for p in output_dir.rglob("*") if p.is_file() and p.name != "manifest.json"}
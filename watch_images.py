@@ -0,0 +1,132 @@
+# watch_images.py
+
+import os
+import sys
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+from pathlib import Path
+
+# inotify event masks (linux/inotify.h). IN_CREATE is left out on purpose:
+# a file being copied in is only interesting once it has been closed.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE
+
+_EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+class InotifyWatcher:
+    """Changed file names in one directory, from Linux inotify via libc."""
+    kind = "inotify"
+
+    def __init__(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(str(directory)), WATCH_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch failed for {directory}")
+
+    def read(self, timeout):
+        """Waits up to `timeout` seconds and returns the names that changed."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        names = []
+        offset = 0
+        while offset < len(data):
+            _, _, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if name:
+                names.append(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Changed file names in one directory, by comparing (mtime, size) snapshots."""
+    kind = "polling"
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        for entry in os.scandir(self.directory):
+            if entry.is_file():
+                st = entry.stat()
+                snapshot[entry.name] = (st.st_mtime_ns, st.st_size)
+        return snapshot
+
+    def read(self, timeout):
+        time.sleep(timeout)
+        current = self._scan()
+        changed = [n for n in current.keys() | self.snapshot.keys() if current.get(n) != self.snapshot.get(n)]
+        self.snapshot = current
+        return changed
+
+    def close(self):
+        pass
+
+
+def make_watcher(directory, polling=False):
+    """inotify where available, polling everywhere else."""
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(directory)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(directory)
+
+
+class Debouncer:
+    """Collects names until no new event has arrived for `delay` seconds."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.pending = set()
+        self.last_event = 0.0
+
+    def add(self, names):
+        if names:
+            self.pending.update(names)
+            self.last_event = time.monotonic()
+
+    def flush(self):
+        if self.pending and time.monotonic() - self.last_event >= self.delay:
+            batch, self.pending = self.pending, set()
+            return batch
+        return set()
+
+
+def iter_changes(watcher, directory, debounce=0.5, tick=0.2):
+    """
+    Yields a set of changed paths in `directory` every `tick` seconds (often
+    empty, so the caller can do other work between events). A burst of events
+    for the same files is delivered once, after `debounce` seconds of quiet.
+    Closes `watcher` when the generator is closed.
+    """
+    debouncer = Debouncer(debounce)
+    try:
+        while True:
+            debouncer.add(watcher.read(tick))
+            yield {Path(directory) / name for name in debouncer.flush()}
+    finally:
+        watcher.close()
+